@@ -9,13 +9,26 @@ import sys
 import shutil
 import re
 import functools
+import argparse
+import contextlib
+import cProfile
+import marshal
+import threading
+import hashlib
+import hmac
+import queue
+import shlex
+import math
+import xml.etree.ElementTree as ET
+from collections import deque
 from pathlib import Path
 from datetime import datetime
 from typing import Optional, Dict, Any, List, Tuple
 
-from flask import Flask, request
+from flask import Flask, Response, g, request
 from flask_restx import Api, Resource, fields
 from telethon import TelegramClient
+from telethon.errors import FloodWaitError
 from telethon.sessions import MemorySession
 
 print = functools.partial(print, flush=True)
@@ -24,6 +37,7 @@ ANDROID_SESSION_AVAILABLE = False
 
 try:
     from AndroidTelePorter import AndroidSession
+    from AndroidTelePorter.utils.filesmanager import read_tgnet, read_userconfig
     ANDROID_SESSION_AVAILABLE = True
 except ImportError as e:
     ANDROID_SESSION_AVAILABLE = False
@@ -34,6 +48,21 @@ SESSIONS_DIR = Path("./sessions")
 SESSIONS_DIR.mkdir(exist_ok=True)
 ADB_DEVICE = "localhost:5555"
 
+TELEGRAM_DATA_DIR = "/data/data/org.telegram.messenger.web"
+TELEGRAM_LAUNCH_ACTIVITY = "org.telegram.messenger.web/org.telegram.ui.LaunchActivity"
+TGNET_REMOTE = f"{TELEGRAM_DATA_DIR}/files/tgnet.dat"
+USERCONFIG_REMOTE = f"{TELEGRAM_DATA_DIR}/shared_prefs/userconfing.xml"
+DEVICE_TRANSFER_DIR = "/sdcard/telegram_session"
+
+ANDROID_DEVICES = [d.strip() for d in os.environ.get("ANDROID_DEVICES", ADB_DEVICE).split(",") if d.strip()]
+WARM_POOL_SIZE = int(os.environ.get("WARM_POOL_SIZE", "0"))
+DEVICE_LEASE_TTL = int(os.environ.get("DEVICE_LEASE_TTL", "900"))
+
+TELEGRAM_RATE_PER_DC = float(os.environ.get("TELEGRAM_RATE_PER_DC", "0.5"))
+TELEGRAM_BURST_PER_DC = int(os.environ.get("TELEGRAM_BURST_PER_DC", "3"))
+TELEGRAM_MAX_RETRIES = int(os.environ.get("TELEGRAM_MAX_RETRIES", "3"))
+TELEGRAM_MAX_FLOOD_WAIT = int(os.environ.get("TELEGRAM_MAX_FLOOD_WAIT", "20"))
+
 app = Flask(__name__)
 api = Api(
     app,
@@ -48,8 +77,21 @@ auth_start_model = api.model('AuthStart', {
     'phone': fields.String(required=True, description='Номер телефона в формате +7')
 })
 
+auth_code_model = api.model('AuthCode', {
+    'phone': fields.String(required=True, description='Номер телефона в формате +7'),
+    'code': fields.String(description='Код подтверждения из SMS или Telegram'),
+    'password': fields.String(description='Облачный пароль (двухэтапная аутентификация)')
+})
+
+profiling_model = api.model('Profiling', {
+    'endpoint': fields.String(required=True, description='Эндпоинт: /auth/extract-and-save, /sessions или /status'),
+    'count': fields.Integer(default=1, description='Сколько следующих запросов профилировать'),
+    'mode': fields.String(default='cprofile', description='cprofile (pstats) или sampling (collapsed stacks)')
+})
+
 extract_model = api.model('Extract', {
-    'phone': fields.String(required=True, description='Номер телефона в формате +7')
+    'phone': fields.String(required=True, description='Номер телефона в формате +7'),
+    'force': fields.Boolean(default=False, description='Извлечь заново, даже если файлы на устройстве не изменились')
 })
 
 reauthorize_model = api.model('Reauthorize', {
@@ -220,6 +262,23 @@ class InfrastructureManager:
                 return True
             return False
 
+    def connect_devices(self, devices: List[str]) -> List[str]:
+        print("\nПОДКЛЮЧЕНИЕ УСТРОЙСТВ ПУЛА:", flush=True)
+
+        connected = []
+        for device in devices:
+            result = subprocess.run(
+                f"adb connect {device}",
+                shell=True, capture_output=True, text=True
+            )
+            if "connected" in result.stdout:
+                print(f"ADB подключен к {device}", flush=True)
+                connected.append(device)
+            else:
+                print(f"Не удалось подключиться к {device}", flush=True)
+
+        return connected
+
     def setup_all(self) -> bool:
        
 
@@ -242,18 +301,21 @@ class InfrastructureManager:
 
         return True
 
-def adb(command: str) -> tuple[bool, str]:
-    full_cmd = f"adb -s {ADB_DEVICE} {command}"
+def adb(command: str, device: Optional[str] = None) -> tuple[bool, str]:
+    full_cmd = f"adb -s {device or ADB_DEVICE} {command}"
     try:
         result = subprocess.run(full_cmd, shell=True, capture_output=True, text=True, timeout=30)
         return result.returncode == 0, result.stdout.strip()
     except Exception as e:
         return False, str(e)
 
-def adb_root_command(commands: List[str], timeout: int = 30) -> tuple[bool, str]:
+def adb_pause(seconds: float) -> None:
+    time.sleep(seconds)
+
+def adb_root_command(commands: List[str], timeout: int = 30, device: Optional[str] = None) -> tuple[bool, str]:
     try:
         process = subprocess.Popen(
-            ["adb", "-s", ADB_DEVICE, "shell"],
+            ["adb", "-s", device or ADB_DEVICE, "shell"],
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
@@ -265,7 +327,7 @@ def adb_root_command(commands: List[str], timeout: int = 30) -> tuple[bool, str]
 
         process.stdin.write("su\n")
         process.stdin.flush()
-        time.sleep(1)
+        adb_pause(1)
 
         while True:
             ready, _, _ = select.select([process.stdout], [], [], 1)
@@ -280,7 +342,7 @@ def adb_root_command(commands: List[str], timeout: int = 30) -> tuple[bool, str]
         for cmd in commands:
             process.stdin.write(f"{cmd}\n")
             process.stdin.flush()
-            time.sleep(2)
+            adb_pause(2)
 
             cmd_output = ""
             while True:
@@ -318,20 +380,20 @@ def telegram_installed() -> bool:
     success, output = adb("shell pm list packages | grep org.telegram.messenger")
     return bool(output.strip())
 
-def clear_telegram() -> None:
+def clear_telegram(device: Optional[str] = None) -> None:
     print("Очистка данных Telegram...", flush=True)
-    adb("shell pm clear org.telegram.messenger.web")
+    adb("shell pm clear org.telegram.messenger.web", device)
     time.sleep(2)
 
-def launch_telegram() -> None:
+def launch_telegram(device: Optional[str] = None) -> None:
     print("Запуск Telegram...", flush=True)
-    adb("shell am start -n org.telegram.messenger.web/org.telegram.ui.LaunchActivity")
+    adb(f"shell am start -n {TELEGRAM_LAUNCH_ACTIVITY}", device)
     print("\n", flush=True)
     print("Откройте scrcpy в другом окне:", flush=True)
     print("   scrcpy -s localhost:5555", flush=True)
     print("\n", flush=True)
 
-def is_authorized() -> bool:
+def is_authorized(device: Optional[str] = None) -> bool:
     try:
         print("Проверка авторизации...", flush=True)
         
@@ -339,7 +401,7 @@ def is_authorized() -> bool:
             'sqlite3 /data/data/org.telegram.messenger.web/files/cache4.db "SELECT COUNT(*) FROM users;"'
         ]
         
-        success, output = adb_root_command(commands, timeout=10)
+        success, output = adb_root_command(commands, timeout=10, device=device)
 
         if not success or not output:
             print("Нет вывода от sqlite", flush=True)
@@ -360,91 +422,618 @@ def is_authorized() -> bool:
         print(f"Ошибка при проверке авторизации: {e}", flush=True)
         return False
 
-def pull_file(remote: str, local: str) -> bool:
-    try:
-        print(f"Копирование {remote}...", flush=True)
+LOGIN_SCREENS = [
+    ('confirm', ['Is this the correct number', 'Это правильный номер']),
+    ('password', ['Your Password', 'Two-Step Verification', 'Облачный пароль', 'Ваш пароль']),
+    ('code', ['Check your Telegram messages', 'Enter code', "We've sent", 'Введите код', 'Мы отправили']),
+    ('phone', ['Your phone number', 'Your Phone', 'Ваш номер телефона', 'Ваш телефон']),
+    ('intro', ['Start Messaging', 'Начать общение']),
+    ('chats', ['New Message', 'Новое сообщение'])
+]
+LOGIN_NEXT_BUTTONS = ['Done', 'Next', 'Continue', 'Готово', 'Далее', 'Продолжить']
+LOGIN_CONFIRM_BUTTONS = ['Yes', 'Да']
+LOGIN_STABLE_STATES = {'waiting_for_code', 'waiting_for_password', 'authorized', 'error'}
+LOGIN_STEP_TIMEOUT = int(os.environ.get("LOGIN_STEP_TIMEOUT", "30"))
+LOGIN_INPUT_TIMEOUT = int(os.environ.get("LOGIN_INPUT_TIMEOUT", "600"))
+
+class UiHierarchy:
+
+    def __init__(self, xml_text: str, digest: str):
+        self.digest = digest
+        self.nodes: List[Dict[str, Any]] = []
+        self._screen = None
+
+        for element in ET.fromstring(xml_text).iter('node'):
+            bounds = re.findall(r'\d+', element.get('bounds', ''))
+            if len(bounds) != 4:
+                continue
+            x1, y1, x2, y2 = map(int, bounds)
+            self.nodes.append({
+                'text': element.get('text', ''),
+                'desc': element.get('content-desc', ''),
+                'class': element.get('class', ''),
+                'clickable': element.get('clickable') == 'true',
+                'center': ((x1 + x2) // 2, (y1 + y2) // 2)
+            })
+
+    def find(self, markers: List[str]) -> Optional[Dict[str, Any]]:
+        lowered = [marker.lower() for marker in markers]
+        for node in self.nodes:
+            label = f"{node['text']} {node['desc']}".lower()
+            if any(marker in label for marker in lowered):
+                return node
+        return None
 
-        mkdir_commands = [
-            "mkdir -p /sdcard/telegram_session",
-            "chmod 777 /sdcard/telegram_session"
-        ]
-        adb_root_command(mkdir_commands, timeout=5)
-        
-        filename = remote.split('/')[-1]
-        copy_commands = [
-            f"cp {remote} /sdcard/telegram_session/{filename}",
-            f"chmod 644 /sdcard/telegram_session/{filename}"
-        ]
-        
-        success, output = adb_root_command(copy_commands, timeout=15)
-        
+    def edit_fields(self) -> List[Dict[str, Any]]:
+        return [node for node in self.nodes if node['class'].endswith('EditText')]
+
+    @property
+    def screen(self) -> str:
+        if self._screen is None:
+            self._screen = 'unknown'
+            for name, markers in LOGIN_SCREENS:
+                if self.find(markers):
+                    self._screen = name
+                    break
+        return self._screen
+
+class UiAutomator:
+    """Работа с UI Android через uiautomator dump и input, с кэшем разобранных дампов."""
+
+    def __init__(self, adb_func=None, clock=time.monotonic, sleep=time.sleep,
+                 poll_interval: float = 0.3, cache_size: int = 32):
+        self._adb = adb_func or adb
+        self._clock = clock
+        self._sleep = sleep
+        self.poll_interval = poll_interval
+        self.cache_size = cache_size
+        self._cache: Dict[str, UiHierarchy] = {}
+
+    def dump(self) -> Optional[UiHierarchy]:
+        success, output = self._adb("exec-out uiautomator dump /dev/tty")
         if not success:
-            print("Не удалось скопировать файл на sdcard", flush=True)
-            return False
+            return None
 
-        time.sleep(1)
+        start = output.find('<hierarchy')
+        end = output.rfind('</hierarchy>')
+        if start < 0 or end < 0:
+            return None
 
-        pull_cmd = f"adb -s {ADB_DEVICE} pull /sdcard/telegram_session/{filename} {local}"
-        print(f"  Выполнение команды: {pull_cmd}", flush=True)
-        result = subprocess.run(pull_cmd, shell=True, capture_output=True, text=True, timeout=30)
+        xml_text = output[start:end + len('</hierarchy>')]
+        digest = hashlib.sha1(xml_text.encode('utf-8')).hexdigest()
 
-        cleanup_commands = [f"rm /sdcard/telegram_session/{filename}"]
-        adb_root_command(cleanup_commands, timeout=5)
+        hierarchy = self._cache.get(digest)
+        if hierarchy is None:
+            try:
+                hierarchy = UiHierarchy(xml_text, digest)
+            except ET.ParseError as e:
+                print(f"Ошибка разбора дампа UI: {e}", flush=True)
+                return None
+            self._cache[digest] = hierarchy
+            if len(self._cache) > self.cache_size:
+                self._cache.pop(next(iter(self._cache)))
+        return hierarchy
+
+    def wait_for_screen(self, accept, timeout: float) -> Tuple[Optional[str], Optional[UiHierarchy]]:
+        deadline = self._clock() + timeout
+        last_digest = None
+
+        while self._clock() < deadline:
+            hierarchy = self.dump()
+            if hierarchy and hierarchy.digest != last_digest:
+                last_digest = hierarchy.digest
+                if accept(hierarchy.screen):
+                    return hierarchy.screen, hierarchy
+            self._sleep(self.poll_interval)
 
-        if result.returncode == 0 and Path(local).exists():
-            local_size = Path(local).stat().st_size
-            print(f"Файл скопирован: {local} ({local_size} байт)", flush=True)
-            return True
+        return None, None
+
+    def tap(self, node: Dict[str, Any]) -> None:
+        x, y = node['center']
+        self._adb(f"shell input tap {x} {y}")
+
+    def input_text(self, text: str) -> None:
+        device_cmd = f"input text {shlex.quote(text.replace(' ', '%s'))}"
+        self._adb(f"shell {shlex.quote(device_cmd)}")
+
+    def keyevent(self, *codes: str) -> None:
+        self._adb(f"shell input keyevent {' '.join(codes)}")
+
+class LoginDriver:
+    """Автоматический вход в Telegram: ввод номера, кода и облачного пароля."""
+
+    def __init__(self, phone: str, device: Optional[str] = None, ui: Optional[UiAutomator] = None,
+                 authorized_check=None, step_timeout: float = LOGIN_STEP_TIMEOUT,
+                 input_timeout: float = LOGIN_INPUT_TIMEOUT, on_error=None):
+        self.phone = phone
+        self.device = device
+        self.on_error = on_error
+        self.ui = ui or UiAutomator(adb_func=functools.partial(adb, device=device))
+        self._authorized_check = authorized_check or functools.partial(is_authorized, device)
+        self.step_timeout = step_timeout
+        self.input_timeout = input_timeout
+        self.state = 'starting'
+        self.error = None
+        self.version = 0
+        self._changed = threading.Condition()
+        self._inputs = {'code': queue.Queue(), 'password': queue.Queue()}
+        self._cancelled = threading.Event()
+
+    def _set_state(self, state: str, error: Optional[str] = None) -> None:
+        with self._changed:
+            self.state = state
+            self.error = error
+            self.version += 1
+            if state == 'error' and self.on_error:
+                self.on_error(self)
+            self._changed.notify_all()
+        print(f"Вход {self.phone}: {state}" + (f" ({error})" if error else ""), flush=True)
+
+    def start(self) -> None:
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def submit(self, code: Optional[str] = None, password: Optional[str] = None) -> None:
+        if code:
+            self._inputs['code'].put(code)
+        if password:
+            self._inputs['password'].put(password)
+
+    def wait_until_stable(self, timeout: float, after_version: int = -1, states=LOGIN_STABLE_STATES) -> str:
+        with self._changed:
+            self._changed.wait_for(
+                lambda: self.version > after_version and self.state in states,
+                timeout
+            )
+            return self.state
+
+    def _next_input(self, kind: str) -> str:
+        deadline = time.monotonic() + self.input_timeout
+        while time.monotonic() < deadline:
+            if self._cancelled.is_set():
+                raise RuntimeError('Вход отменён')
+            try:
+                return self._inputs[kind].get(timeout=1)
+            except queue.Empty:
+                continue
+        raise RuntimeError(f'Не получен {kind} за {self.input_timeout} сек.')
+
+    def _wait(self, accept, what: str) -> Tuple[str, UiHierarchy]:
+        screen, hierarchy = self.ui.wait_for_screen(accept, self.step_timeout)
+        if screen is None:
+            raise RuntimeError(f'Не дождались экрана: {what}')
+        return screen, hierarchy
+
+    def _press_next(self, hierarchy: UiHierarchy) -> None:
+        button = hierarchy.find(LOGIN_NEXT_BUTTONS)
+        if button:
+            self.ui.tap(button)
         else:
-            print(f"Не удалось скопировать файл: {result.stderr}", flush=True)
-            return False
-            
-    except Exception as e:
-        print(f"Ошибка при копировании: {e}", flush=True)
-        return False
+            self.ui.keyevent('KEYCODE_ENTER')
+
+    def _fill(self, hierarchy: UiHierarchy, text: str, clear: bool = False) -> None:
+        fields = hierarchy.edit_fields()
+        if fields:
+            self.ui.tap(fields[0])
+        if clear:
+            self.ui.keyevent('KEYCODE_MOVE_END', *['KEYCODE_DEL'] * 8)
+        self.ui.input_text(text)
+
+    def _enter_phone(self) -> Tuple[str, UiHierarchy]:
+        self._set_state('entering_phone')
+        screen, hierarchy = self._wait(lambda s: s in ('intro', 'phone'), 'ввод номера')
+        if screen == 'intro':
+            self.ui.tap(hierarchy.find(dict(LOGIN_SCREENS)['intro']))
+            screen, hierarchy = self._wait(lambda s: s == 'phone', 'ввод номера')
+
+        self._fill(hierarchy, re.sub(r'\D', '', self.phone), clear=True)
+        self._press_next(hierarchy)
+
+        screen, hierarchy = self._wait(lambda s: s in ('confirm', 'code', 'password'), 'ввод кода')
+        if screen == 'confirm':
+            self.ui.tap(hierarchy.find(LOGIN_CONFIRM_BUTTONS) or hierarchy.find(LOGIN_NEXT_BUTTONS))
+            screen, hierarchy = self._wait(lambda s: s in ('code', 'password'), 'ввод кода')
+        return screen, hierarchy
+
+    def run(self) -> None:
+        try:
+            screen, hierarchy = self._enter_phone()
+            error = None
+
+            while True:
+                kind = 'code' if screen == 'code' else 'password'
+                self._set_state(f'waiting_for_{kind}', error)
+                value = self._next_input(kind)
+
+                self._set_state(f'entering_{kind}')
+                self._fill(hierarchy, value)
+                if kind == 'password':
+                    self._press_next(hierarchy)
+
+                next_screen, next_hierarchy = self.ui.wait_for_screen(
+                    lambda s: s not in (screen, 'unknown'), self.step_timeout
+                )
+                if next_screen in ('code', 'password'):
+                    screen, hierarchy, error = next_screen, next_hierarchy, None
+                    continue
+
+                if next_screen is None and not self._authorized_check():
+                    error = 'Код не принят' if kind == 'code' else 'Пароль не принят'
+                    continue
+
+                if next_screen is None or self._authorized_check():
+                    self._set_state('authorized')
+                else:
+                    self._set_state('error', 'Экран входа закрыт, но авторизация не подтверждена')
+                return
+
+        except Exception as e:
+            self._set_state('error', str(e))
+
+login_drivers: Dict[str, LoginDriver] = {}
+
+def release_failed_login(driver: LoginDriver) -> None:
+    if login_drivers.get(driver.phone) is driver and warm_pool.device_for(driver.phone) == driver.device:
+        warm_pool.release(driver.device)
+
+LOGIN_MESSAGES = {
+    'entering_phone': 'Выполняется ввод номера, статус: GET /api/auth/status/<phone>',
+    'waiting_for_code': 'Номер введён. Отправьте код через /api/auth/code',
+    'waiting_for_password': 'Требуется облачный пароль. Отправьте его через /api/auth/code',
+    'authorized': 'Авторизация завершена, можно извлекать сессию',
+    'error': 'Автоматический вход не удался, продолжите вручную через scrcpy'
+}
+
+def telegram_in_foreground(device: Optional[str] = None) -> bool:
+    success, output = adb("shell dumpsys activity activities | grep -E 'mResumedActivity|topResumedActivity'", device)
+    return success and TELEGRAM_LAUNCH_ACTIVITY in output
+
+class WarmDevicePool:
+    """Пул устройств, заранее сброшенных и открытых на экране ввода номера Telegram.
+
+    Состояния устройства: idle, warming, warm, in_use (идёт вход) и done (сессия
+    извлечена, устройство остаётся за номером до тех пор, пока не понадобится пулу).
+    Устройство in_use, не освобождённое за lease_ttl секунд, считается брошенным
+    и может быть отдано другому номеру.
+    """
+
+    def __init__(self, devices: List[str], size: int, warm_timeout: float = LOGIN_STEP_TIMEOUT,
+                 lease_ttl: float = DEVICE_LEASE_TTL):
+        self.devices = list(devices)
+        self.size = min(size, len(self.devices))
+        self.warm_timeout = warm_timeout
+        self.lease_ttl = lease_ttl
+        self.hits = 0
+        self.misses = 0
+        self.warm_failures = 0
+        self.phone_devices: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._states = {device: 'idle' for device in self.devices}
+        self._done_at: Dict[str, float] = {}
+        self._leased_at: Dict[str, float] = {}
+
+    def _forget(self, device: str) -> None:
+        for phone in [p for p, d in self.phone_devices.items() if d == device]:
+            del self.phone_devices[phone]
+
+    def _with_state(self, state: str) -> List[str]:
+        devices = [device for device, current in self._states.items() if current == state]
+        if state == 'done':
+            devices.sort(key=lambda device: self._done_at.get(device, 0))
+        return devices
+
+    def _expired(self) -> List[str]:
+        now = time.monotonic()
+        devices = [device for device in self._with_state('in_use')
+                   if now - self._leased_at.get(device, now) > self.lease_ttl]
+        return sorted(devices, key=lambda device: self._leased_at[device])
+
+    def _lease(self, phone: str, device: str) -> None:
+        self._states[device] = 'in_use'
+        self._leased_at[device] = time.monotonic()
+        self._done_at.pop(device, None)
+        self._forget(device)
+        self.phone_devices[phone] = device
+
+    def replenish(self) -> None:
+        with self._lock:
+            ready = len(self._with_state('warm')) + len(self._with_state('warming'))
+            to_warm = (self._with_state('idle') + self._with_state('done'))[:max(0, self.size - ready)]
+            for device in to_warm:
+                self._states[device] = 'warming'
+                self._done_at.pop(device, None)
+                self._forget(device)
+
+        for device in to_warm:
+            threading.Thread(target=self._warm, args=(device,), daemon=True).start()
+
+    def _warm(self, device: str) -> None:
+        print(f"Подготовка устройства {device} для пула...", flush=True)
+        screen = None
+        try:
+            clear_telegram(device)
+            launch_telegram(device)
+
+            deadline = time.monotonic() + self.warm_timeout
+            while not telegram_in_foreground(device) and time.monotonic() < deadline:
+                time.sleep(0.5)
+
+            ui = UiAutomator(adb_func=functools.partial(adb, device=device))
+            screen, hierarchy = ui.wait_for_screen(lambda s: s in ('intro', 'phone'), self.warm_timeout)
+            if screen == 'intro':
+                ui.tap(hierarchy.find(dict(LOGIN_SCREENS)['intro']))
+                screen, hierarchy = ui.wait_for_screen(lambda s: s == 'phone', self.warm_timeout)
+        except Exception as e:
+            print(f"Ошибка подготовки устройства {device}: {e}", flush=True)
+
+        with self._lock:
+            if self._states.get(device) != 'warming':
+                return
+            if screen == 'phone':
+                self._states[device] = 'warm'
+                print(f"Устройство {device} готово (экран ввода номера)", flush=True)
+            else:
+                self._states[device] = 'idle'
+                self.warm_failures += 1
+                print(f"Не удалось подготовить устройство {device}", flush=True)
+
+    def acquire(self, phone: str) -> Tuple[Optional[str], bool]:
+        with self._lock:
+            own = self.phone_devices.get(phone)
+            if own and self._states.get(own) in ('in_use', 'done'):
+                device, is_warm = own, False
+            else:
+                warm = self._with_state('warm')
+                candidates = warm or self._with_state('idle') or self._with_state('done') or self._expired()
+                if not candidates:
+                    return None, False
+                device, is_warm = candidates[0], bool(warm)
+                if self._states[device] == 'in_use':
+                    print(f"Аренда устройства {device} истекла, устройство передаётся {phone}", flush=True)
+
+            self._lease(phone, device)
+
+        if is_warm and not telegram_in_foreground(device):
+            print(f"Устройство {device} больше не на экране Telegram", flush=True)
+            is_warm = False
+
+        with self._lock:
+            if is_warm:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        self.replenish()
+        return device, is_warm
+
+    def lease_by_account(self, phone: str, account_phone_func) -> Optional[str]:
+        """Находит свободное устройство, на котором авторизован аккаунт phone, и отдаёт его номеру."""
+        with self._lock:
+            candidates = self._with_state('done') + self._with_state('idle')
+
+        for device in candidates:
+            try:
+                check_account_phone(phone, account_phone_func(device))
+            except AccountMismatchError:
+                continue
+
+            with self._lock:
+                if self._states.get(device) not in ('done', 'idle'):
+                    continue
+                self._lease(phone, device)
+            print(f"Аккаунт {phone} найден на устройстве {device}", flush=True)
+            return device
+        return None
+
+    def release(self, device: Optional[str]) -> None:
+        with self._lock:
+            if self._states.get(device) != 'in_use':
+                return
+            self._states[device] = 'done'
+            self._done_at[device] = time.monotonic()
+            self._leased_at.pop(device, None)
+        self.replenish()
+
+    def device_for(self, phone: str) -> Optional[str]:
+        with self._lock:
+            device = self.phone_devices.get(phone)
+            if device and self._states.get(device) in ('in_use', 'done'):
+                return device
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'warm_failures': self.warm_failures,
+                'warm': sum(1 for state in self._states.values() if state == 'warm'),
+                'devices': dict(self._states)
+            }
+
+infra_manager: Optional[InfrastructureManager] = None
+warm_pool = WarmDevicePool(ANDROID_DEVICES, WARM_POOL_SIZE)
+
+class TelegramScheduler:
+    """Планировщик вызовов Telegram: token bucket на каждый DC, пауза DC при FloodWait, повтор с backoff."""
+
+    def __init__(self, rate: float, burst: int, max_retries: int = 3, max_flood_wait: int = 20,
+                 backoff: float = 1.0, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.max_flood_wait = max_flood_wait
+        self.backoff = backoff
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._buckets: Dict[int, Dict[str, float]] = {}
+        self._parked_until: Dict[int, float] = {}
+        self._queued: Dict[int, int] = {}
+        self.flood_waits = 0
+
+    def _reserve(self, dc_id: int, budget: float) -> float:
+        now = self._clock()
+
+        parked_for = self._parked_until.get(dc_id, 0) - now
+        if parked_for > budget:
+            raise FloodWaitError(request=None, capture=math.ceil(parked_for))
+        if parked_for > 0:
+            return parked_for
+
+        bucket = self._buckets.setdefault(dc_id, {'tokens': float(self.burst), 'updated': now})
+        bucket['tokens'] = min(float(self.burst), bucket['tokens'] + (now - bucket['updated']) * self.rate)
+        bucket['updated'] = now
+
+        if bucket['tokens'] >= 1:
+            bucket['tokens'] -= 1
+            return 0.0
+        return (1 - bucket['tokens']) / self.rate
+
+    def _acquire(self, dc_id: int, budget: float) -> float:
+        waited = 0.0
+        with self._lock:
+            self._queued[dc_id] = self._queued.get(dc_id, 0) + 1
+        try:
+            while True:
+                with self._lock:
+                    delay = self._reserve(dc_id, budget - waited)
+                if delay <= 0:
+                    return waited
+                self._sleep(delay)
+                waited += delay
+        finally:
+            with self._lock:
+                self._queued[dc_id] -= 1
+
+    def park(self, dc_id: int, seconds: float) -> None:
+        with self._lock:
+            until = self._clock() + seconds
+            self._parked_until[dc_id] = max(self._parked_until.get(dc_id, 0), until)
+            self.flood_waits += 1
+
+    def call(self, dc_id: int, func, *args, **kwargs):
+        attempt = 0
+        waited = 0.0
+        while True:
+            waited += self._acquire(dc_id, self.max_flood_wait - waited)
+            try:
+                return func(*args, **kwargs)
+            except FloodWaitError as e:
+                print(f"FloodWait для DC {dc_id}: {e.seconds} сек.", flush=True)
+                self.park(dc_id, e.seconds)
+                if attempt >= self.max_retries or waited + e.seconds > self.max_flood_wait:
+                    raise
+            except (OSError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                print(f"Ошибка сети для DC {dc_id}: {e}, повтор через {delay} сек.", flush=True)
+                self._sleep(delay)
+            attempt += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = self._clock()
+            dcs = set(self._buckets) | set(self._queued)
+            return {
+                'queue_depth': sum(self._queued.values()),
+                'flood_waits': self.flood_waits,
+                'dcs': {
+                    str(dc_id): {
+                        'queued': self._queued.get(dc_id, 0),
+                        'parked_for': round(max(0.0, self._parked_until.get(dc_id, 0) - now), 1)
+                    }
+                    for dc_id in sorted(dcs)
+                }
+            }
+
+telegram_scheduler = TelegramScheduler(
+    rate=TELEGRAM_RATE_PER_DC,
+    burst=TELEGRAM_BURST_PER_DC,
+    max_retries=TELEGRAM_MAX_RETRIES,
+    max_flood_wait=TELEGRAM_MAX_FLOOD_WAIT
+)
+
+def session_dc_id(session_file: Path) -> int:
+    json_file = session_file.with_suffix('.json')
+    try:
+        with open(json_file, 'r', encoding='utf-8') as f:
+            return int(json.load(f).get('dc_id') or 0)
+    except Exception:
+        pass
+
+    try:
+        conn = sqlite3.connect(f"file:{session_file}?mode=ro", uri=True)
+        try:
+            row = conn.execute("SELECT dc_id FROM sessions").fetchone()
+        finally:
+            conn.close()
+        return int(row[0]) if row and row[0] else 0
+    except Exception:
+        return 0
 
 def is_session_valid(session_file: Path, api_id: int, api_hash: str) -> bool:
     try:
         async def check():
-            client = TelegramClient(str(session_file), api_id, api_hash)
-            await client.connect()
-            is_valid = await client.is_user_authorized()
-            await client.disconnect()
-            return is_valid
-        
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        result = loop.run_until_complete(check())
-        loop.close()
-        return result
+            client = TelegramClient(str(session_file), api_id, api_hash, flood_sleep_threshold=0)
+            try:
+                await client.connect()
+                return await client.is_user_authorized()
+            finally:
+                await client.disconnect()
+
+        def run_check():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                return loop.run_until_complete(check())
+            finally:
+                loop.close()
+
+        return telegram_scheduler.call(session_dc_id(session_file), run_check)
     except Exception as e:
         print(f"Ошибка проверки сессии: {e}", flush=True)
         return False
 
-def pull_tgnet_and_userconfig(phone: str) -> Tuple[Optional[Path], Optional[Path]]:
-    print(f"\nКОПИРОВАНИЕ ФАЙЛОВ ДЛЯ {phone}...", flush=True)
+def pull_root_files(files: List[Tuple[str, Path]], device: Optional[str] = None) -> bool:
+    copy_commands = [f"mkdir -p {DEVICE_TRANSFER_DIR}", f"chmod 777 {DEVICE_TRANSFER_DIR}"]
+    for remote, _ in files:
+        filename = remote.split('/')[-1]
+        copy_commands.append(f"cp {remote} {DEVICE_TRANSFER_DIR}/{filename}")
+        copy_commands.append(f"chmod 644 {DEVICE_TRANSFER_DIR}/{filename}")
 
-    if not is_authorized():
-        print("Telegram не авторизован на Android", flush=True)
-        return None, None
+    success, output = adb_root_command(copy_commands, timeout=15, device=device)
+    if not success:
+        print("Не удалось скопировать файлы на sdcard", flush=True)
+        return False
+
+    try:
+        for remote, local in files:
+            filename = remote.split('/')[-1]
+            pull_cmd = f"adb -s {device or ADB_DEVICE} pull {DEVICE_TRANSFER_DIR}/{filename} {local}"
+            print(f"  Выполнение команды: {pull_cmd}", flush=True)
+            result = subprocess.run(pull_cmd, shell=True, capture_output=True, text=True, timeout=30)
+
+            if result.returncode != 0 or not local.exists():
+                print(f"Не удалось скопировать {filename}: {result.stderr}", flush=True)
+                return False
+    finally:
+        adb(f"shell rm -rf {DEVICE_TRANSFER_DIR}", device)
+
+    return True
+
+def pull_tgnet_and_userconfig(phone: str, device: Optional[str] = None) -> Tuple[Optional[Path], Optional[Path]]:
+    print(f"\nКОПИРОВАНИЕ ФАЙЛОВ ДЛЯ {phone}...", flush=True)
 
     tgnet_local = SESSIONS_DIR / f"tgnet_{phone}.dat"
     userconfig_local = SESSIONS_DIR / f"userconfing_{phone}.xml"
 
-    print("Копирование tgnet.dat...", flush=True)
-    if not pull_file(
-        "/data/data/org.telegram.messenger.web/files/tgnet.dat",
-        str(tgnet_local)
-    ):
-        print("Не удалось скопировать tgnet.dat", flush=True)
-        return None, None
-
-    print("Копирование userconfing.xml...", flush=True)
-    if not pull_file(
-        "/data/data/org.telegram.messenger.web/shared_prefs/userconfing.xml",
-        str(userconfig_local)
-    ):
-        print("Не удалось скопировать userconfing.xml", flush=True)
+    print("Копирование tgnet.dat и userconfing.xml на sdcard...", flush=True)
+    if not pull_root_files([(TGNET_REMOTE, tgnet_local), (USERCONFIG_REMOTE, userconfig_local)], device):
         return None, None
 
     print(f"Файлы скопированы:", flush=True)
@@ -453,70 +1042,150 @@ def pull_tgnet_and_userconfig(phone: str) -> Tuple[Optional[Path], Optional[Path
 
     return tgnet_local, userconfig_local
 
-def extract_session_with_android_porter(phone: str) -> Optional[Dict[str, Any]]:
-    print(f"\nИЗВЛЕЧЕНИЕ СЕССИИ ДЛЯ {phone}", flush=True)
+def device_account_phone(device: Optional[str] = None) -> Optional[str]:
+    if not ANDROID_SESSION_AVAILABLE:
+        return None
 
-    tgnet_path, userconfig_path = pull_tgnet_and_userconfig(phone)
-    
-    if not tgnet_path or not userconfig_path:
-        print("Не удалось скопировать файлы", flush=True)
+    device_name = re.sub(r'\W', '_', device or ADB_DEVICE)
+    userconfig_local = SESSIONS_DIR / f"userconfing_{device_name}.xml"
+    try:
+        if not pull_root_files([(USERCONFIG_REMOTE, userconfig_local)], device):
+            return None
+        return read_self_user(read_userconfig(str(userconfig_local)))['account_phone']
+    except Exception as e:
+        print(f"Не удалось прочитать аккаунт на устройстве {device}: {e}", flush=True)
         return None
+    finally:
+        userconfig_local.unlink(missing_ok=True)
+
+def parse_session_probe(output: str) -> Tuple[bool, Optional[Dict[str, str]]]:
+    match = re.search(r'users=(\d+)', output or '')
+    authorized = bool(match) and int(match.group(1)) > 0
+
+    hashes = {}
+    for digest, path in re.findall(r'\b([0-9a-f]{64})\s+(\S+)', output or ''):
+        hashes[path.split('/')[-1]] = digest
+
+    if set(hashes) != {TGNET_REMOTE.split('/')[-1], USERCONFIG_REMOTE.split('/')[-1]}:
+        return authorized, None
+    return authorized, hashes
 
-    print("Создание сессии через AndroidTelePorter...", flush=True)
-    session = AndroidSession.from_tgnet(
-        tgnet_path=str(tgnet_path),
-        userconfig_path=str(userconfig_path)
+def probe_device_session(device: Optional[str] = None) -> Tuple[bool, Optional[Dict[str, str]]]:
+    command = (
+        f'echo users=$(sqlite3 {TELEGRAM_DATA_DIR}/files/cache4.db "SELECT COUNT(*) FROM users;"); '
+        f'sha256sum {TGNET_REMOTE} {USERCONFIG_REMOTE}'
     )
-    print("Сессия успешно загружена!", flush=True)
+    success, output = adb_root_command([command], timeout=10, device=device)
+    if not success or not output:
+        print("Нет вывода от устройства", flush=True)
+        return False, None
 
-    phone_session = SESSIONS_DIR / f"{phone}.session"
-    session.to_telethon(str(phone_session))
-    print(f"Сессия сохранена: {phone_session}", flush=True)
+    authorized, hashes = parse_session_probe(output)
+    if not authorized:
+        print("Пользователь не авторизован (таблица users пуста)", flush=True)
+    elif not hashes:
+        print("Не удалось получить хэши файлов сессии", flush=True)
+    return authorized, hashes
+
+def load_unchanged_session(phone: str, hashes: Optional[Dict[str, str]]) -> Optional[Dict[str, Any]]:
+    json_file = SESSIONS_DIR / f"{phone}.json"
+    session_file = SESSIONS_DIR / f"{phone}.session"
+
+    if not hashes or not json_file.exists() or not session_file.exists():
+        return None
 
-    auth_key_hex = None
-    dc_id = None
-    user_id = None
-    extracted_username = None
-    
     try:
-        conn = sqlite3.connect(str(phone_session))
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT dc_id, auth_key FROM sessions")
-        session_row = cursor.fetchone()
-        if session_row:
-            dc_id = session_row[0]
-            auth_key_blob = session_row[1]
-            if auth_key_blob:
-                auth_key_hex = auth_key_blob.hex()
-        
-        cursor.execute("SELECT id, username FROM entities WHERE id > 0 LIMIT 1")
-        user_row = cursor.fetchone()
-        if user_row:
-            user_id = user_row[0]
-            extracted_username = user_row[1]
-        
-        conn.close()
-        
-        print(f"ИЗВЛЕЧЕННЫЕ ДАННЫЕ:", flush=True)
-        print(f"   DC ID: {dc_id}", flush=True)
-        print(f"   User ID: {user_id}", flush=True)
-        print(f"   Username: {extracted_username}", flush=True)
-        if auth_key_hex:
-            print(f"   Auth Key: {auth_key_hex[:50]}...", flush=True)
-        
+        with open(json_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
     except Exception as e:
-        print(f"Ошибка чтения SQLite: {e}", flush=True)
+        print(f"Ошибка чтения {json_file}: {e}", flush=True)
+        return None
+
+    if data.get('source_hashes') != hashes:
+        return None
+
+    print(f"Файлы сессии не изменились с {data.get('extracted_at')}", flush=True)
+    return {
+        'phone': phone,
+        'auth_key': data.get('auth_key'),
+        'dc_id': data.get('dc_id'),
+        'user_id': data.get('user_id'),
+        'username': data.get('username'),
+        'account_phone': data.get('account_phone'),
+        'first_name': data.get('first_name'),
+        'last_name': data.get('last_name'),
+        'extracted_at': data.get('extracted_at'),
+        'cached': True,
+        'message': 'Сессия не изменилась'
+    }
+
+class AccountMismatchError(Exception):
+    pass
 
-    tgnet_path.unlink(missing_ok=True)
-    userconfig_path.unlink(missing_ok=True)
+def normalize_phone(phone: str) -> str:
+    return '+' + re.sub(r'\D', '', phone)
+
+def check_account_phone(phone: str, account_phone: Optional[str]) -> None:
+    if not account_phone or normalize_phone(account_phone) != normalize_phone(phone):
+        raise AccountMismatchError(
+            f"На устройстве авторизован другой аккаунт ({account_phone or 'номер неизвестен'}), ожидался {phone}"
+        )
+
+def read_self_user(userconfig_manager) -> Dict[str, Any]:
+    user = userconfig_manager.userconfig
+    return {
+        'user_id': getattr(user, 'id', None) or 0,
+        'username': getattr(user, 'username', None),
+        'account_phone': getattr(user, 'phone', None),
+        'first_name': getattr(user, 'first_name', None),
+        'last_name': getattr(user, 'last_name', None)
+    }
+
+def extract_session_with_android_porter(phone: str,
+                                        source_hashes: Optional[Dict[str, str]] = None,
+                                        device: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    print(f"\nИЗВЛЕЧЕНИЕ СЕССИИ ДЛЯ {phone}", flush=True)
+
+    tgnet_path, userconfig_path = pull_tgnet_and_userconfig(phone, device)
+    
+    if not tgnet_path or not userconfig_path:
+        print("Не удалось скопировать файлы", flush=True)
+        return None
+
+    try:
+        print("Создание сессии через AndroidTelePorter...", flush=True)
+        tgnet_manager = read_tgnet(str(tgnet_path))
+        userconfig_manager = read_userconfig(str(userconfig_path))
+        check_account_phone(phone, read_self_user(userconfig_manager)['account_phone'])
+        session = AndroidSession(tgnet_manager=tgnet_manager, userconfig_manager=userconfig_manager)
+        print("Сессия успешно загружена!", flush=True)
+
+        phone_session = SESSIONS_DIR / f"{phone}.session"
+        session.to_telethon(str(phone_session))
+        print(f"Сессия сохранена: {phone_session}", flush=True)
+    finally:
+        tgnet_path.unlink(missing_ok=True)
+        userconfig_path.unlink(missing_ok=True)
+
+    dc_id = tgnet_manager.session.dc_id
+    auth_key = tgnet_manager.session.auth_key
+    auth_key_hex = auth_key.hex() if auth_key else None
+    self_user = read_self_user(userconfig_manager)
+
+    print(f"ИЗВЛЕЧЕННЫЕ ДАННЫЕ:", flush=True)
+    print(f"   DC ID: {dc_id}", flush=True)
+    print(f"   User ID: {self_user['user_id']}", flush=True)
+    print(f"   Username: {self_user['username']}", flush=True)
+    print(f"   Phone: {self_user['account_phone']}", flush=True)
+    if auth_key_hex:
+        print(f"   Auth Key: {auth_key_hex[:50]}...", flush=True)
 
     result = {
         'phone': phone,
         'auth_key': auth_key_hex,
         'dc_id': dc_id,
-        'user_id': user_id if user_id else 0,
-        'username': extracted_username,
+        **self_user,
+        'cached': False,
         'message': 'Сессия успешно извлечена'
     }
     
@@ -524,15 +1193,222 @@ def extract_session_with_android_porter(phone: str) -> Optional[Dict[str, Any]]:
     with open(json_file, 'w', encoding='utf-8') as f:
         json.dump({
             'phone': phone,
-            'user_id': user_id if user_id else 0,
-            'username': extracted_username,
+            **self_user,
             'dc_id': dc_id,
             'auth_key': auth_key_hex,
+            'source_hashes': source_hashes,
             'extracted_at': datetime.now().isoformat()
         }, f, ensure_ascii=False, indent=2)
     
     return result
 
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN")
+PROFILABLE_ENDPOINTS = ['/auth/extract-and-save', '/sessions', '/status']
+PROFILING_MODES = ['cprofile', 'sampling']
+
+class StackSampler:
+    """Сэмплирующий профайлер одного потока, результат в формате collapsed stacks."""
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{Path(frame.f_code.co_filename).name}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if stack:
+                key = ';'.join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return '\n'.join(f"{stack} {count}" for stack, count in sorted(self.samples.items())) + '\n'
+
+class SubprocessTimer:
+    """Время ожидания subprocess и фиксированных пауз adb в профилируемых потоках.
+
+    Обёртки установлены только пока идёт профилирование.
+    """
+
+    TARGETS = [
+        (subprocess.Popen, 'wait', 'subprocess'),
+        (subprocess.Popen, 'communicate', 'subprocess'),
+        (select, 'select', 'subprocess'),
+        (sys.modules[__name__], 'adb_pause', 'adb_pause')
+    ]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._threads: Dict[int, Dict[str, float]] = {}
+        self._originals: List[Tuple[Any, str, Any]] = []
+
+    def _wrap(self, original, category: str):
+        timer = self
+
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            data = timer._threads.get(threading.get_ident())
+            if data is None or data['depth']:
+                return original(*args, **kwargs)
+
+            data['depth'] += 1
+            started = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                data[category] += time.perf_counter() - started
+                data['depth'] -= 1
+
+        return wrapper
+
+    def start(self, thread_id: int) -> None:
+        with self._lock:
+            if not self._threads:
+                for owner, name, category in self.TARGETS:
+                    original = getattr(owner, name)
+                    self._originals.append((owner, name, original))
+                    setattr(owner, name, self._wrap(original, category))
+            self._threads[thread_id] = {'subprocess': 0.0, 'adb_pause': 0.0, 'depth': 0}
+
+    def stop(self, thread_id: int) -> Dict[str, float]:
+        with self._lock:
+            data = self._threads.pop(thread_id, None)
+            if not self._threads:
+                for owner, name, original in self._originals:
+                    setattr(owner, name, original)
+                self._originals.clear()
+        return data or {'subprocess': 0.0, 'adb_pause': 0.0}
+
+subprocess_timer = SubprocessTimer()
+
+class RequestProfiler:
+    """Профилирование следующих N запросов к эндпоинту; без включённых планов hooks ничего не делают."""
+
+    def __init__(self, max_results: int = 20):
+        self._lock = threading.Lock()
+        self._active = False
+        self._next_id = 1
+        self.plans: Dict[str, Dict[str, Any]] = {}
+        self.results = deque(maxlen=max_results)
+
+    def arm(self, endpoint: str, count: int, mode: str) -> None:
+        with self._lock:
+            self.plans[f"{api.prefix}{endpoint}"] = {'endpoint': endpoint, 'mode': mode, 'remaining': count}
+
+    def disarm(self) -> None:
+        with self._lock:
+            self.plans.clear()
+            self.results.clear()
+
+    def begin(self, path: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            plan = self.plans.get(path)
+            if not plan or self._active:
+                return None
+            plan['remaining'] -= 1
+            if plan['remaining'] <= 0:
+                del self.plans[path]
+            self._active = True
+
+        run = {
+            'endpoint': plan['endpoint'],
+            'mode': plan['mode'],
+            'started_at': datetime.now().isoformat(),
+            'thread_id': threading.get_ident(),
+            'wall': time.perf_counter(),
+            'cpu': time.thread_time()
+        }
+        subprocess_timer.start(run['thread_id'])
+        if plan['mode'] == 'cprofile':
+            run['profiler'] = cProfile.Profile()
+            run['profiler'].enable()
+        else:
+            run['profiler'] = StackSampler(threading.get_ident())
+            run['profiler'].start()
+        return run
+
+    def finish(self, run: Dict[str, Any]) -> None:
+        cpu = time.thread_time() - run['cpu']
+        wall = time.perf_counter() - run['wall']
+        waits = subprocess_timer.stop(run['thread_id'])
+        profiler = run['profiler']
+
+        if run['mode'] == 'cprofile':
+            profiler.disable()
+            profiler.create_stats()
+            data = marshal.dumps(profiler.stats)
+        else:
+            profiler.stop()
+            data = profiler.collapsed().encode('utf-8')
+
+        with self._lock:
+            self.results.append({
+                'id': self._next_id,
+                'endpoint': run['endpoint'],
+                'mode': run['mode'],
+                'started_at': run['started_at'],
+                'wall_seconds': round(wall, 3),
+                'python_cpu_seconds': round(cpu, 3),
+                'subprocess_seconds': round(waits['subprocess'], 3),
+                'adb_pause_seconds': round(waits['adb_pause'], 3),
+                'other_wait_seconds': round(max(0.0, wall - cpu - waits['subprocess'] - waits['adb_pause']), 3),
+                'data': data
+            })
+            self._next_id += 1
+            self._active = False
+
+    def get(self, result_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            for result in self.results:
+                if result['id'] == result_id:
+                    return result
+        return None
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'endpoints': PROFILABLE_ENDPOINTS,
+                'plans': [dict(plan) for plan in self.plans.values()],
+                'results': [
+                    {key: value for key, value in result.items() if key != 'data'}
+                    for result in self.results
+                ]
+            }
+
+request_profiler = RequestProfiler()
+
+@app.before_request
+def start_request_profiling():
+    if not request_profiler.plans:
+        return
+    g.profile_run = request_profiler.begin(request.path)
+
+@app.teardown_request
+def finish_request_profiling(exc):
+    run = g.pop('profile_run', None)
+    if run:
+        request_profiler.finish(run)
+
+def check_admin_token() -> Optional[Tuple[Dict[str, str], int]]:
+    if not PROFILING_TOKEN:
+        return {'error': 'Профилирование отключено (PROFILING_TOKEN не задан)'}, 404
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode('utf-8'), PROFILING_TOKEN.encode('utf-8')):
+        return {'error': 'Неверный токен администратора'}, 403
+    return None
+
 @api.route('/status')
 class Status(Resource):
     def get(self):
@@ -559,7 +1435,9 @@ class Status(Resource):
             'telegram_authorized_on_android': telegram_authorized,
             'sessions_count': len(sessions),
             'sessions': [f.stem for f in sessions],
-            'session_files': [f.stem for f in telethon_sessions]
+            'session_files': [f.stem for f in telethon_sessions],
+            'telegram_scheduler': telegram_scheduler.stats(),
+            'warm_pool': warm_pool.stats()
         }
 
 @api.route('/auth/start')
@@ -574,15 +1452,94 @@ class AuthStart(Resource):
         if not phone:
             return {'error': 'Укажите номер телефона'}, 400
 
-        clear_telegram()
-        launch_telegram()
-      
-        
-        return {
-            'status': 'waiting_for_code',
+        previous = login_drivers.pop(phone, None)
+        if previous:
+            previous.cancel()
+
+        device, warm = warm_pool.acquire(phone)
+        if not device:
+            return {'error': 'Нет свободных Android устройств'}, 503
+
+        if warm:
+            print(f"Используется подготовленное устройство {device}", flush=True)
+        else:
+            clear_telegram(device)
+            launch_telegram(device)
+
+        driver = LoginDriver(phone, device=device, on_error=release_failed_login)
+        login_drivers[phone] = driver
+        driver.start()
+        state = driver.wait_until_stable(timeout=LOGIN_STEP_TIMEOUT, states=LOGIN_STABLE_STATES | {'entering_phone'})
+
+        response = {
+            'status': state,
+            'phone': phone,
+            'device': device,
+            'warm_start': warm,
+            'message': LOGIN_MESSAGES.get(state, 'Выполняется ввод номера')
+        }
+        if state == 'error':
+            response['error'] = driver.error
+        return response, 200 if state in LOGIN_STABLE_STATES else 202
+
+@api.route('/auth/status/<string:phone>')
+class AuthStatus(Resource):
+    def get(self, phone):
+        driver = login_drivers.get(phone)
+        if not driver:
+            return {'error': f'Авторизация для {phone} не запущена. Вызовите /api/auth/start'}, 404
+
+        response = {
+            'status': driver.state,
+            'phone': phone,
+            'device': driver.device,
+            'message': LOGIN_MESSAGES.get(driver.state, 'Выполняется ввод номера')
+        }
+        if driver.error:
+            response['error'] = driver.error
+        return response
+
+@api.route('/auth/code')
+class AuthCode(Resource):
+    @api.expect(auth_code_model)
+    def post(self):
+        data = request.json
+        phone = data.get('phone')
+        code = data.get('code')
+        password = data.get('password')
+
+        print(f"\nПОЛУЧЕН КОД ДЛЯ {phone}", flush=True)
+
+        if not phone:
+            return {'error': 'Укажите номер телефона'}, 400
+
+        if not code and not password:
+            return {'error': 'Укажите код или пароль'}, 400
+
+        driver = login_drivers.get(phone)
+        if not driver:
+            return {'error': f'Авторизация для {phone} не запущена. Вызовите /api/auth/start'}, 404
+
+        if driver.state in ('authorized', 'error'):
+            return {'status': driver.state, 'phone': phone, 'error': driver.error,
+                    'message': LOGIN_MESSAGES[driver.state]}
+
+        if driver.state not in ('waiting_for_code', 'waiting_for_password'):
+            return {'status': driver.state, 'phone': phone,
+                    'error': 'Telegram ещё не ожидает код, повторите запрос позже'}, 409
+
+        version = driver.version
+        driver.submit(code=code, password=password)
+        state = driver.wait_until_stable(timeout=LOGIN_STEP_TIMEOUT * 2, after_version=version)
+
+        response = {
+            'status': state,
             'phone': phone,
-            'message': 'Telegram запущен. Введите номер и код вручную через scrcpy'
+            'message': LOGIN_MESSAGES.get(state, 'Выполняется ввод кода')
         }
+        if driver.error:
+            response['error'] = driver.error
+        return response
 
 @api.route('/auth/extract-and-save')
 class AuthExtractAndSave(Resource):
@@ -590,6 +1547,7 @@ class AuthExtractAndSave(Resource):
     def post(self):
         data = request.json
         phone = data.get('phone')
+        force = bool(data.get('force', False))
 
         print(f"\nЗАПРОС НА ИЗВЛЕЧЕНИЕ СЕССИИ ДЛЯ {phone}", flush=True)
        
@@ -600,14 +1558,41 @@ class AuthExtractAndSave(Resource):
         if not ANDROID_SESSION_AVAILABLE:
             return {'error': 'AndroidTelePorter не доступен'}, 500
 
-        if not is_authorized():
-            return {'error': 'Telegram не авторизован на Android.'}, 400
+        driver = login_drivers.get(phone)
+        if driver and driver.state not in ('authorized', 'error'):
+            return {'status': driver.state, 'phone': phone,
+                    'error': 'Вход ещё не завершён, извлечение невозможно'}, 409
 
-        session = extract_session_with_android_porter(phone)
-        if not session:
-            return {'error': 'Не удалось извлечь данные'}, 404
+        device = warm_pool.device_for(phone) or warm_pool.lease_by_account(phone, device_account_phone)
+        if not device:
+            return {'error': f'Для {phone} нет устройства с авторизацией. Выполните /api/auth/start'}, 409
 
-        return session
+        try:
+            authorized, hashes = probe_device_session(device)
+            if not authorized:
+                return {'error': 'Telegram не авторизован на Android.'}, 400
+
+            if not force:
+                cached = load_unchanged_session(phone, hashes)
+                if cached:
+                    check_account_phone(phone, cached.get('account_phone'))
+                    return cached
+
+            session = extract_session_with_android_porter(phone, hashes, device)
+            if not session:
+                return {'error': 'Не удалось извлечь данные'}, 404
+
+            return session
+
+        except AccountMismatchError as e:
+            print(f"{e}", flush=True)
+            return {'error': str(e)}, 409
+
+        finally:
+            driver = login_drivers.pop(phone, None)
+            if driver:
+                driver.cancel()
+            warm_pool.release(device)
 
 @api.route('/auth/reauthorize/<string:phone>')
 class Reauthorize(Resource):
@@ -668,9 +1653,8 @@ class Reauthorize(Resource):
         print(f"API Hash: {api_hash[:5]}...", flush=True)
 
         try:
-            client = TelegramClient(str(session_file), api_id, api_hash)
-
             async def reauthorize():
+                client = TelegramClient(str(session_file), api_id, api_hash, flood_sleep_threshold=0)
                 try:
                     print("Подключение к Telegram...", flush=True)
                     await client.connect()
@@ -678,6 +1662,7 @@ class Reauthorize(Resource):
 
                     if not await client.is_user_authorized():
                         print("Сессия не авторизована", flush=True)
+                        await client.disconnect()
                         return {"success": False, "error": "Сессия не авторизована"}
 
                     print("Получение информации о пользователе...", flush=True)
@@ -699,16 +1684,27 @@ class Reauthorize(Resource):
                         "message": "Авторизация успешна!"
                     }
 
+                except (FloodWaitError, OSError, asyncio.TimeoutError):
+                    await client.disconnect()
+                    raise
                 except Exception as e:
                     print(f"Ошибка: {e}", flush=True)
+                    await client.disconnect()
                     return {"success": False, "error": str(e)}
 
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            result = loop.run_until_complete(reauthorize())
-            loop.close()
+            def run_reauthorize():
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+                try:
+                    return loop.run_until_complete(reauthorize())
+                finally:
+                    loop.close()
 
-            return result
+            return telegram_scheduler.call(session_dc_id(session_file), run_reauthorize)
+
+        except FloodWaitError as e:
+            print(f"FloodWait: повторите через {e.seconds} сек.", flush=True)
+            return {"success": False, "error": f"FloodWait: повторите через {e.seconds} сек.", "retry_after": e.seconds}, 429
 
         except Exception as e:
             print(f"Ошибка: {e}", flush=True)
@@ -729,6 +1725,9 @@ class SessionsList(Resource):
                         'phone': data.get('phone'),
                         'user_id': data.get('user_id'),
                         'username': data.get('username'),
+                        'account_phone': data.get('account_phone'),
+                        'first_name': data.get('first_name'),
+                        'last_name': data.get('last_name'),
                         'dc_id': data.get('dc_id'),
                         'extracted_at': data.get('extracted_at')
                     })
@@ -780,24 +1779,314 @@ class SessionsList(Resource):
             print(f"Ошибка при удалении: {e}", flush=True)
             return {'error': f'Ошибка при удалении: {e}'}, 500
 
+@api.route('/admin/profiling')
+class Profiling(Resource):
+    def get(self):
+        denied = check_admin_token()
+        if denied:
+            return denied
+        return request_profiler.summary()
+
+    @api.expect(profiling_model)
+    def post(self):
+        denied = check_admin_token()
+        if denied:
+            return denied
+
+        data = request.json
+        endpoint = data.get('endpoint')
+        count = data.get('count', 1)
+        mode = data.get('mode', 'cprofile')
+
+        if endpoint not in PROFILABLE_ENDPOINTS:
+            return {'error': f'Эндпоинт должен быть одним из: {", ".join(PROFILABLE_ENDPOINTS)}'}, 400
+
+        if mode not in PROFILING_MODES:
+            return {'error': f'Режим должен быть одним из: {", ".join(PROFILING_MODES)}'}, 400
+
+        if not isinstance(count, int) or count < 1:
+            return {'error': 'count должен быть положительным числом'}, 400
 
+        print(f"\nПРОФИЛИРОВАНИЕ {endpoint}: {count} запросов, режим {mode}", flush=True)
+        request_profiler.arm(endpoint, count, mode)
+        return request_profiler.summary()
 
-print("\nПРОВЕРКА ЗАВИСИМОСТЕЙ:", flush=True)
-if ANDROID_SESSION_AVAILABLE:
-    print("AndroidTelePorter успешно импортирован", flush=True)
-else:
-    print("AndroidTelePorter не доступен", flush=True)
+    def delete(self):
+        denied = check_admin_token()
+        if denied:
+            return denied
+
+        print("\nПРОФИЛИРОВАНИЕ ОТКЛЮЧЕНО", flush=True)
+        request_profiler.disarm()
+        return {'message': 'Профилирование отключено, результаты удалены'}
+
+@api.route('/admin/profiling/<int:result_id>')
+class ProfilingResult(Resource):
+    def get(self, result_id):
+        denied = check_admin_token()
+        if denied:
+            return denied
+
+        result = request_profiler.get(result_id)
+        if not result:
+            return {'error': f'Результат {result_id} не найден'}, 404
+
+        if result['mode'] == 'cprofile':
+            filename, mimetype = f"profile_{result_id}.pstats", 'application/octet-stream'
+        else:
+            filename, mimetype = f"profile_{result_id}.collapsed.txt", 'text/plain'
+
+        return Response(
+            result['data'],
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
 
 
-infra_manager = InfrastructureManager()
-if not infra_manager.setup_all():
-    print("\nНекоторые компоненты не настроены", flush=True)
+BATCH_STEPS = ['extract', 'validate', 'export']
+PHONE_PATTERN = re.compile(r'\+?\d{7,15}')
 
+def parse_batch_job(line: str, defaults: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+
+    if line.startswith('{'):
+        job = json.loads(line)
+        if not isinstance(job, dict):
+            raise ValueError(f'Задание должно быть JSON объектом: {line}')
+    else:
+        job = {'phone': line}
+
+    phone = job.get('phone')
+    if not isinstance(phone, str) or not PHONE_PATTERN.fullmatch(re.sub(r'[\s()-]', '', phone)):
+        raise ValueError(f'Некорректный номер телефона: {line}')
+    if not isinstance(job.get('steps', []), list):
+        raise ValueError(f'steps должен быть списком: {line}')
+
+    for key, value in defaults.items():
+        job.setdefault(key, value)
+    job['phone'] = normalize_phone(phone)
+    job['id'] = str(job.get('id') or job['phone'])
+    return job
+
+def load_batch_checkpoint(output: Path, retry_failed: bool) -> set:
+    done = set()
+    if not output.exists():
+        return done
+
+    with open(output, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('status') == 'ok' or not retry_failed:
+                done.add(record.get('id'))
+    return done
+
+class BatchDevices:
+    """Устройства пакетной обработки: на каком устройстве какой аккаунт и блокировка на каждое устройство."""
+
+    def __init__(self, devices: List[str], account_phone_func=None):
+        self.devices = list(devices)
+        self._account_phone = account_phone_func or device_account_phone
+        self._locks = {device: threading.Lock() for device in self.devices}
+        self._locks_guard = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._accounts: Optional[Dict[str, str]] = None
+
+    def lock(self, device: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(device, threading.Lock())
+
+    def _scan(self) -> Dict[str, str]:
+        accounts = {}
+        for device in self.devices:
+            with self.lock(device):
+                account_phone = self._account_phone(device)
+            print(f"Устройство {device}: аккаунт {account_phone or 'не найден'}", flush=True)
+            if account_phone:
+                accounts[normalize_phone(account_phone)] = device
+        return accounts
+
+    def device_for(self, phone: str) -> Optional[str]:
+        with self._scan_lock:
+            if self._accounts is None:
+                self._accounts = self._scan()
+        return self._accounts.get(normalize_phone(phone))
+
+def run_batch_job(job: Dict[str, Any], devices: BatchDevices) -> Dict[str, Any]:
+    phone = job['phone']
+    record = {'id': job['id'], 'phone': phone, 'status': 'ok', 'started_at': datetime.now().isoformat()}
+
+    try:
+        for step in job['steps']:
+            if step == 'extract':
+                if not ANDROID_SESSION_AVAILABLE:
+                    raise RuntimeError('AndroidTelePorter не доступен')
+
+                device = job.get('device') or devices.device_for(phone)
+                if not device:
+                    raise RuntimeError(f'Аккаунт {phone} не авторизован ни на одном устройстве')
+
+                record['device'] = device
+                with devices.lock(device):
+                    authorized, hashes = probe_device_session(device)
+                    if not authorized:
+                        raise RuntimeError('Telegram не авторизован на Android')
+
+                    session = None if job.get('force') else load_unchanged_session(phone, hashes)
+                    session = session or extract_session_with_android_porter(phone, hashes, device)
+                    if not session:
+                        raise RuntimeError('Не удалось извлечь данные')
+                    check_account_phone(phone, session.get('account_phone'))
+                    record['cached'] = session.get('cached', False)
+
+            elif step == 'validate':
+                if not job.get('api_id') or not job.get('api_hash'):
+                    raise RuntimeError('Для проверки укажите api_id и api_hash')
+
+                session_file = SESSIONS_DIR / f"{phone}.session"
+                if not session_file.exists():
+                    raise RuntimeError(f'Сессия для {phone} не найдена')
+                record['valid'] = is_session_valid(session_file, int(job['api_id']), job['api_hash'])
+
+            elif step == 'export':
+                json_file = SESSIONS_DIR / f"{phone}.json"
+                if not json_file.exists():
+                    raise RuntimeError(f'Сессия для {phone} не найдена')
+                with open(json_file, 'r', encoding='utf-8') as f:
+                    record['session'] = json.load(f)
+
+            else:
+                raise RuntimeError(f'Неизвестный шаг: {step}')
+
+    except Exception as e:
+        print(f"Ошибка задания {job['id']}: {e}", flush=True)
+        record['status'] = 'error'
+        record['error'] = str(e)
 
-print(f"\nПапка для сессий: {SESSIONS_DIR.absolute()}", flush=True)
-print(f"Swagger UI: http://localhost:5000/swagger/", flush=True)
-print(f"Для ручного ввода: scrcpy -s localhost:5555", flush=True)
-print("\n", flush=True)
+    record['finished_at'] = datetime.now().isoformat()
+    return record
+
+def run_batch(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog='manager.py batch',
+        description='Пакетное извлечение, проверка и экспорт сессий без HTTP'
+    )
+    parser.add_argument('jobs', help='Файл с заданиями (номер или JSON на строку), "-" для stdin')
+    parser.add_argument('-o', '--output', default='batch_results.ndjson',
+                        help='NDJSON с результатами, он же checkpoint для продолжения')
+    parser.add_argument('-p', '--parallel', type=int, default=1, help='Количество параллельных заданий')
+    parser.add_argument('--steps', default='extract,export', help=f'Шаги через запятую: {",".join(BATCH_STEPS)}')
+    parser.add_argument('--api-id', type=int, default=os.environ.get('TELEGRAM_API_ID'))
+    parser.add_argument('--api-hash', default=os.environ.get('TELEGRAM_API_HASH'))
+    parser.add_argument('--force', action='store_true', help='Извлекать заново, даже если файлы не изменились')
+    parser.add_argument('--retry-failed', action='store_true', help='Повторить задания, завершившиеся ошибкой')
+    parser.add_argument('--skip-setup', action='store_true', help='Не проверять контейнер, ADB и Telegram')
+    args = parser.parse_args(argv)
+
+    steps = [step.strip() for step in args.steps.split(',') if step.strip()]
+    unknown = [step for step in steps if step not in BATCH_STEPS]
+    if unknown:
+        parser.error(f'неизвестные шаги: {", ".join(unknown)}')
+
+    defaults = {'steps': steps, 'api_id': args.api_id, 'api_hash': args.api_hash, 'force': args.force}
+    output = Path(args.output)
+    done = load_batch_checkpoint(output, args.retry_failed)
+    jobs_file = sys.stdin if args.jobs == '-' else open(args.jobs, 'r', encoding='utf-8')
+
+    with contextlib.redirect_stdout(sys.stderr), open(output, 'a', encoding='utf-8') as results:
+        if args.skip_setup:
+            connected = ANDROID_DEVICES
+        else:
+            connected = setup_infrastructure(start_pool=False)
+
+        devices = BatchDevices(connected)
+
+        jobs: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=args.parallel * 2)
+        results_lock = threading.Lock()
+        counters = {'ok': 0, 'error': 0, 'skipped': 0, 'invalid': 0}
+
+        def worker():
+            while True:
+                job = jobs.get()
+                if job is None:
+                    return
+                record = run_batch_job(job, devices)
+                with results_lock:
+                    results.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    results.flush()
+                    os.fsync(results.fileno())
+                    counters[record['status']] += 1
+                print(f"Задание {record['id']}: {record['status']}", flush=True)
+
+        workers = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, args.parallel))]
+        for thread in workers:
+            thread.start()
+
+        print(f"\nПАКЕТНАЯ ОБРАБОТКА: шаги {','.join(steps)}, потоков {len(workers)}, "
+              f"устройств {len(connected)}, уже выполнено {len(done)}", flush=True)
+
+        try:
+            for line in jobs_file:
+                try:
+                    job = parse_batch_job(line, defaults)
+                except ValueError as e:
+                    print(f"Строка отклонена: {e}", flush=True)
+                    counters['invalid'] += 1
+                    continue
+                if not job:
+                    continue
+                if job['id'] in done:
+                    counters['skipped'] += 1
+                    continue
+                done.add(job['id'])
+                jobs.put(job)
+        finally:
+            for _ in workers:
+                jobs.put(None)
+            for thread in workers:
+                thread.join()
+            if jobs_file is not sys.stdin:
+                jobs_file.close()
+
+        print(f"\nГотово: успешно {counters['ok']}, ошибок {counters['error']}, "
+              f"пропущено {counters['skipped']}, отклонено строк {counters['invalid']}. "
+              f"Результаты: {output.absolute()}", flush=True)
+
+    return 0 if counters['error'] == 0 and counters['invalid'] == 0 else 1
+
+def setup_infrastructure(start_pool: bool = True) -> List[str]:
+    global infra_manager, warm_pool
+
+    print("\nПРОВЕРКА ЗАВИСИМОСТЕЙ:", flush=True)
+    if ANDROID_SESSION_AVAILABLE:
+        print("AndroidTelePorter успешно импортирован", flush=True)
+    else:
+        print("AndroidTelePorter не доступен", flush=True)
+
+    infra_manager = InfrastructureManager()
+    if not infra_manager.setup_all():
+        print("\nНекоторые компоненты не настроены", flush=True)
+
+    connected = infra_manager.connect_devices(ANDROID_DEVICES) or [ADB_DEVICE]
+    warm_pool = WarmDevicePool(connected, WARM_POOL_SIZE)
+    if start_pool:
+        warm_pool.replenish()
+
+    return connected
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        sys.exit(run_batch(sys.argv[2:]))
+
+    setup_infrastructure()
+
+    print(f"\nПапка для сессий: {SESSIONS_DIR.absolute()}", flush=True)
+    print(f"Swagger UI: http://localhost:5000/swagger/", flush=True)
+    print(f"Для ручного ввода: scrcpy -s localhost:5555", flush=True)
+    print("\n", flush=True)
+
     app.run(host='0.0.0.0', port=5000, debug=False)
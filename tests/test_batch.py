@@ -0,0 +1,146 @@
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import manager
+
+
+class FakeAndroidSession:
+    def __init__(self, tgnet_manager, userconfig_manager):
+        self.userconfig = userconfig_manager.userconfig
+
+    def to_telethon(self, filename):
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(self.userconfig.phone)
+
+
+@pytest.fixture
+def device_account(monkeypatch, sessions_dir):
+    """Устройство dev1 с аккаунтом +71000000 и dev2 с аккаунтом +72000000."""
+    accounts = {'dev1': '71000000', 'dev2': '72000000'}
+    probed = []
+
+    def probe(device=None):
+        probed.append(device)
+        return True, {'tgnet.dat': device}
+
+    def pull(phone, device=None):
+        tgnet = sessions_dir / f"tgnet_{phone}.dat"
+        userconfig = sessions_dir / f"userconfing_{phone}.xml"
+        tgnet.write_bytes(b'')
+        userconfig.write_text('', encoding='utf-8')
+        return tgnet, userconfig
+
+    monkeypatch.setattr(manager, 'ANDROID_SESSION_AVAILABLE', True)
+    def extract(phone, hashes, device):
+        manager.check_account_phone(phone, accounts[device])
+        return {'phone': phone, 'account_phone': accounts[device], 'cached': False}
+
+    monkeypatch.setattr(manager, 'ANDROID_DEVICES', ['dev1'])
+    monkeypatch.setattr(manager, 'device_account_phone', lambda device=None: accounts.get(device))
+    monkeypatch.setattr(manager, 'probe_device_session', probe)
+    monkeypatch.setattr(manager, 'pull_tgnet_and_userconfig', pull)
+    monkeypatch.setattr(manager, 'read_tgnet', lambda path: SimpleNamespace(
+        session=SimpleNamespace(dc_id=2, auth_key=b'\x01\x02')), raising=False)
+    monkeypatch.setattr(manager, 'read_userconfig', lambda path: SimpleNamespace(
+        userconfig=SimpleNamespace(id=1001, username='owner', phone='71000000', first_name='Owner')), raising=False)
+    monkeypatch.setattr(manager, 'AndroidSession', FakeAndroidSession, raising=False)
+    return SimpleNamespace(accounts=accounts, probed=probed, extract=extract)
+
+
+def run(tmp_path, lines, *args):
+    jobs = tmp_path / 'jobs.txt'
+    jobs.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    output = tmp_path / 'results.ndjson'
+    code = manager.run_batch([str(jobs), '-o', str(output), '--skip-setup', '--steps', 'extract', *args])
+    records = [json.loads(line) for line in output.read_text(encoding='utf-8').splitlines()]
+    return code, {record['id']: record for record in records}
+
+
+def test_phone_must_match_device_account(tmp_path, sessions_dir, device_account):
+    code, records = run(tmp_path, ['+71000000', '+72000000', '+73000000'], '-p', '3')
+
+    assert code == 1
+    assert records['+71000000']['status'] == 'ok'
+    assert records['+72000000']['status'] == 'error'
+    assert records['+73000000']['status'] == 'error'
+    assert (sessions_dir / '+71000000.session').exists()
+    assert not (sessions_dir / '+72000000.session').exists()
+    assert not (sessions_dir / '+72000000.json').exists()
+    assert not (sessions_dir / '+73000000.json').exists()
+    assert device_account.probed == ['dev1']
+
+
+def test_jobs_are_routed_to_device_with_their_account(tmp_path, monkeypatch, device_account):
+    monkeypatch.setattr(manager, 'ANDROID_DEVICES', ['dev1', 'dev2'])
+    monkeypatch.setattr(manager, 'extract_session_with_android_porter', device_account.extract)
+
+    code, records = run(tmp_path, ['+72000000', '+71000000', '+73000000'], '-p', '2')
+
+    assert records['+71000000']['device'] == 'dev1'
+    assert records['+72000000']['device'] == 'dev2'
+    assert records['+73000000']['status'] == 'error'
+    assert 'device' not in records['+73000000']
+    assert sorted(device_account.probed) == ['dev1', 'dev2']
+
+
+def test_jobs_never_share_a_device(tmp_path, monkeypatch, device_account):
+    active = []
+    overlaps = []
+
+    def extract(phone, hashes, device):
+        active.append(device)
+        overlaps.append(active.count(device) > 1)
+        time.sleep(0.05)
+        active.remove(device)
+        return device_account.extract(phone, hashes, device)
+
+    monkeypatch.setattr(manager, 'extract_session_with_android_porter', extract)
+    lines = [
+        '{"phone": "+71000000", "id": "a", "device": "dev1"}',
+        '{"phone": "+71000000", "id": "b", "device": "dev1"}',
+        '{"phone": "+71000000", "id": "c"}',
+    ]
+
+    code, records = run(tmp_path, lines, '-p', '3', '--force')
+
+    assert code == 0
+    assert len(overlaps) == 3 and not any(overlaps)
+
+
+def test_finished_jobs_are_skipped_on_resume(tmp_path, device_account):
+    run(tmp_path, ['+71000000', '+72000000'])
+    code, records = run(tmp_path, ['+71000000', '+72000000'])
+
+    output = (tmp_path / 'results.ndjson').read_text(encoding='utf-8').splitlines()
+    assert len(output) == 2
+    assert code == 0
+
+
+def test_invalid_lines_are_rejected(tmp_path, device_account):
+    code, records = run(tmp_path, ['bad{', '[1]', '{"phone": "abc"}', '+71000000'])
+
+    assert code == 1
+    assert list(records) == ['+71000000']
+
+
+@pytest.mark.parametrize('line', ['bad{', '{"phone": 79001234567}', '{"phone": "+7900"}', '12ab34567'])
+def test_parse_batch_job_rejects(line):
+    with pytest.raises(ValueError):
+        manager.parse_batch_job(line, {'steps': ['extract']})
+
+
+def test_parse_batch_job_accepts_phone_and_json():
+    job = manager.parse_batch_job('+7 900 123-45-67', {'steps': ['extract']})
+    assert job['phone'] == '+79001234567'
+    assert job['id'] == '+79001234567'
+    assert manager.parse_batch_job('79001234567', {})['id'] == '+79001234567'
+    assert job['steps'] == ['extract']
+
+    job = manager.parse_batch_job('{"phone": "+79001234567", "id": "j1", "steps": ["export"]}', {'steps': ['extract']})
+    assert job['id'] == 'j1'
+    assert job['steps'] == ['export']
+
+    assert manager.parse_batch_job('# комментарий', {}) is None
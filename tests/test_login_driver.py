@@ -0,0 +1,189 @@
+import threading
+from pathlib import Path
+
+import pytest
+
+import manager
+from manager import LoginDriver, UiAutomator
+
+DUMPS_DIR = Path(__file__).parent / 'dumps'
+
+
+class FakeAdb:
+    """Отдаёт записанные дампы uiautomator и переключает экран по командам input."""
+
+    def __init__(self, screen, transitions):
+        self.screen = screen
+        self.transitions = transitions
+        self.commands = []
+        self.dumps = {path.stem: path.read_text(encoding='utf-8') for path in DUMPS_DIR.glob('*.xml')}
+
+    def __call__(self, command):
+        if 'uiautomator dump' in command:
+            return True, self.dumps[self.screen] + 'UI hierchary dumped to: /dev/tty'
+
+        self.commands.append(command)
+        for screen, fragment, next_screen in self.transitions:
+            if screen == self.screen and fragment in command:
+                self.screen = next_screen
+                break
+        return True, ''
+
+    def inputs(self):
+        return [command for command in self.commands if 'input text' in command]
+
+
+def make_driver(fake, step_timeout=1.0):
+    ui = UiAutomator(adb_func=fake, poll_interval=0.01)
+    return LoginDriver(
+        '+7 900 123-45-67', ui=ui,
+        authorized_check=lambda: fake.screen == 'chats',
+        step_timeout=step_timeout, input_timeout=5
+    )
+
+
+def submit(driver, **values):
+    version = driver.version
+    driver.submit(**values)
+    return driver.wait_until_stable(timeout=5, after_version=version)
+
+
+FULL_LOGIN = [
+    ('intro', 'input tap 540 1760', 'phone'),
+    ('phone', 'input tap 940 1780', 'confirm'),
+    ('confirm', 'input tap 860 1040', 'code'),
+    ('code', '12345', 'password'),
+    ('password', 'input tap 940 1780', 'chats'),
+]
+
+
+def test_phone_confirm_code_password_chats():
+    fake = FakeAdb('phone', FULL_LOGIN)
+    driver = make_driver(fake)
+    driver.start()
+
+    assert driver.wait_until_stable(timeout=5) == 'waiting_for_code'
+    assert submit(driver, code='12345') == 'waiting_for_password'
+    assert submit(driver, password='my pa$s') == 'authorized'
+
+    assert fake.inputs() == [
+        "shell 'input text 79001234567'",
+        "shell 'input text 12345'",
+        "shell 'input text '\"'\"'my%spa$s'\"'\"''",
+    ]
+
+
+def test_intro_screen_is_skipped():
+    fake = FakeAdb('intro', FULL_LOGIN)
+    driver = make_driver(fake)
+    driver.start()
+
+    assert driver.wait_until_stable(timeout=5) == 'waiting_for_code'
+    assert fake.commands[0] == 'shell input tap 540 1760'
+
+
+def test_wrong_code_returns_to_waiting_for_code():
+    fake = FakeAdb('phone', [
+        ('phone', 'input tap 940 1780', 'code'),
+        ('code', '54321', 'chats'),
+    ])
+    driver = make_driver(fake, step_timeout=0.3)
+    driver.start()
+
+    assert driver.wait_until_stable(timeout=5) == 'waiting_for_code'
+    assert submit(driver, code='11111') == 'waiting_for_code'
+    assert driver.error == 'Код не принят'
+
+    assert submit(driver, code='54321') == 'authorized'
+    assert driver.error is None
+
+
+def test_phone_screen_not_found_is_error():
+    fake = FakeAdb('chats', [])
+    driver = make_driver(fake, step_timeout=0.2)
+    driver.start()
+
+    assert driver.wait_until_stable(timeout=5) == 'error'
+
+
+def test_hierarchy_cache_reuses_parsed_dumps():
+    fake = FakeAdb('code', [])
+    ui = UiAutomator(adb_func=fake)
+
+    first = ui.dump()
+    assert ui.dump() is first
+    assert first.screen == 'code'
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(manager, 'login_drivers', {})
+    return manager.app.test_client()
+
+
+def test_auth_code_rejected_before_code_screen(client):
+    driver = LoginDriver('+1', ui=UiAutomator(adb_func=FakeAdb('phone', [])))
+    driver.state = 'entering_phone'
+    manager.login_drivers['+1'] = driver
+
+    response = client.post('/api/auth/code', json={'phone': '+1', 'code': '12345'})
+
+    assert response.status_code == 409
+    assert driver._inputs['code'].empty()
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(manager, 'warm_pool', manager.WarmDevicePool(['dev1'], 0))
+    monkeypatch.setattr(manager, 'clear_telegram', lambda device=None: None)
+    monkeypatch.setattr(manager, 'launch_telegram', lambda device=None: None)
+    return manager.warm_pool
+
+
+def test_auth_start_automation_failure_is_not_server_error(client, pool, monkeypatch):
+    monkeypatch.setattr(LoginDriver, 'run', lambda self: self._set_state('error', 'нет экрана'))
+
+    response = client.post('/api/auth/start', json={'phone': '+1'})
+
+    assert response.status_code == 200
+    assert response.json['status'] == 'error'
+    assert response.json['error'] == 'нет экрана'
+    assert pool.stats()['devices'] == {'dev1': 'done'}
+
+
+def test_auth_start_returns_while_phone_is_entered(client, pool, monkeypatch):
+    proceed = threading.Event()
+
+    def run(self):
+        self._set_state('entering_phone')
+        proceed.wait(5)
+        self._set_state('error', 'нет экрана')
+
+    monkeypatch.setattr(LoginDriver, 'run', run)
+
+    response = client.post('/api/auth/start', json={'phone': '+1'})
+
+    assert response.status_code == 202
+    assert response.json['status'] == 'entering_phone'
+    assert client.get('/api/auth/status/+1').json['status'] == 'entering_phone'
+    assert pool.stats()['devices'] == {'dev1': 'in_use'}
+
+    proceed.set()
+    manager.login_drivers['+1'].wait_until_stable(timeout=5)
+    assert client.get('/api/auth/status/+1').json['error'] == 'нет экрана'
+    assert pool.stats()['devices'] == {'dev1': 'done'}
+
+
+def test_cancelled_driver_keeps_device_of_restarted_login(client, pool, monkeypatch):
+    monkeypatch.setattr(LoginDriver, 'run', lambda self: self._set_state('entering_phone'))
+    client.post('/api/auth/start', json={'phone': '+1'})
+    first = manager.login_drivers['+1']
+
+    client.post('/api/auth/start', json={'phone': '+1'})
+    first._set_state('error', 'Вход отменён')
+
+    assert pool.stats()['devices'] == {'dev1': 'in_use'}
+
+
+def test_auth_status_unknown_phone(client):
+    assert client.get('/api/auth/status/+1').status_code == 404
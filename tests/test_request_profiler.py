@@ -0,0 +1,58 @@
+import select
+import subprocess
+import sys
+import time
+
+import pytest
+
+import manager
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(manager, 'PROFILING_TOKEN', 'secret')
+    monkeypatch.setattr(manager, 'request_profiler', manager.RequestProfiler())
+    return manager.app.test_client()
+
+
+HEADERS = {'X-Admin-Token': 'secret'}
+
+
+def test_profiling_requires_token(client):
+    assert client.get('/api/admin/profiling').status_code == 403
+
+
+def test_profiling_rejects_wrong_token(client):
+    assert client.get('/api/admin/profiling', headers={'X-Admin-Token': 'secreT'}).status_code == 403
+    assert client.get('/api/admin/profiling', headers=HEADERS).status_code == 200
+
+
+def test_subprocess_time_is_reported_separately(client, monkeypatch):
+    def slow_check_adb():
+        subprocess.run([sys.executable, '-c', 'import time; time.sleep(0.3)'])
+        manager.adb_pause(0.2)
+        time.sleep(0.2)
+        return False
+
+    monkeypatch.setattr(manager, 'check_adb', slow_check_adb)
+    client.post('/api/admin/profiling', json={'endpoint': '/status'}, headers=HEADERS)
+    client.get('/api/status')
+
+    result = client.get('/api/admin/profiling', headers=HEADERS).json['results'][0]
+    assert result['subprocess_seconds'] >= 0.3
+    assert 0.2 <= result['adb_pause_seconds'] < 0.3
+    assert 0.15 <= result['other_wait_seconds'] < 0.3
+    assert client.get(f"/api/admin/profiling/{result['id']}", headers=HEADERS).status_code == 200
+
+
+def test_wrappers_removed_after_profiling(client):
+    wait, communicate, select_func = subprocess.Popen.wait, subprocess.Popen.communicate, select.select
+    adb_pause = manager.adb_pause
+
+    client.post('/api/admin/profiling', json={'endpoint': '/sessions'}, headers=HEADERS)
+    client.get('/api/sessions')
+
+    assert subprocess.Popen.wait is wait
+    assert subprocess.Popen.communicate is communicate
+    assert select.select is select_func
+    assert manager.adb_pause is adb_pause
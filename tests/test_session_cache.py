@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+import manager
+
+TGNET_HASH = 'a' * 64
+USERCONFIG_HASH = 'b' * 64
+
+PROBE_OUTPUT = f"""root@generic_x86_64:/ #
+users=3
+{TGNET_HASH}  /data/data/org.telegram.messenger.web/files/tgnet.dat
+{USERCONFIG_HASH}  /data/data/org.telegram.messenger.web/shared_prefs/userconfing.xml
+"""
+
+HASHES = {'tgnet.dat': TGNET_HASH, 'userconfing.xml': USERCONFIG_HASH}
+
+
+def save_session(sessions_dir, phone, **data):
+    (sessions_dir / f'{phone}.session').write_bytes(b'')
+    (sessions_dir / f'{phone}.json').write_text(json.dumps(data), encoding='utf-8')
+
+
+def test_probe_checks_authorization_and_hashes_in_one_root_call(monkeypatch):
+    calls = []
+
+    def root(commands, timeout=30, device=None):
+        calls.append((commands, device))
+        return True, PROBE_OUTPUT
+
+    monkeypatch.setattr(manager, 'adb_root_command', root)
+
+    assert manager.probe_device_session('dev1') == (True, HASHES)
+    assert len(calls) == 1
+    assert len(calls[0][0]) == 1
+    assert calls[0][1] == 'dev1'
+
+
+@pytest.mark.parametrize('output, expected', [
+    (PROBE_OUTPUT, (True, HASHES)),
+    (PROBE_OUTPUT.replace('users=3', 'users=0'), (False, HASHES)),
+    (PROBE_OUTPUT.replace('users=3', 'users='), (False, HASHES)),
+    (f"users=1\n{TGNET_HASH}  /data/.../files/tgnet.dat\n"
+     "sha256sum: .../userconfing.xml: No such file or directory\n", (True, None)),
+    ('', (False, None)),
+])
+def test_parse_session_probe(output, expected):
+    assert manager.parse_session_probe(output) == expected
+
+
+def test_unchanged_session_is_loaded(sessions_dir):
+    save_session(sessions_dir, '+1', account_phone='1', source_hashes=HASHES)
+
+    cached = manager.load_unchanged_session('+1', HASHES)
+
+    assert cached['cached'] is True
+    assert cached['account_phone'] == '1'
+
+
+@pytest.mark.parametrize('hashes', [
+    {'tgnet.dat': TGNET_HASH, 'userconfing.xml': 'c' * 64},
+    None,
+])
+def test_changed_session_is_not_loaded(sessions_dir, hashes):
+    save_session(sessions_dir, '+1', account_phone='1', source_hashes=HASHES)
+
+    assert manager.load_unchanged_session('+1', hashes) is None
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(manager, 'ANDROID_SESSION_AVAILABLE', True)
+    monkeypatch.setattr(manager, 'login_drivers', {})
+    monkeypatch.setattr(manager, 'warm_pool', manager.WarmDevicePool(['dev1'], 0))
+    monkeypatch.setattr(manager, 'probe_device_session', lambda device=None: (True, HASHES))
+    manager.warm_pool.acquire('+1')
+    return manager.app.test_client()
+
+
+def test_force_extracts_even_when_unchanged(client, sessions_dir, monkeypatch):
+    save_session(sessions_dir, '+1', account_phone='1', source_hashes=HASHES)
+    extracted = []
+
+    def extract(phone, hashes, device):
+        extracted.append((phone, hashes, device))
+        return {'phone': phone, 'cached': False}
+
+    monkeypatch.setattr(manager, 'extract_session_with_android_porter', extract)
+
+    response = client.post('/api/auth/extract-and-save', json={'phone': '+1', 'force': True})
+
+    assert response.json['cached'] is False
+    assert extracted == [('+1', HASHES, 'dev1')]
+
+
+def test_cached_session_of_other_account_is_conflict(client, sessions_dir):
+    save_session(sessions_dir, '+1', account_phone='2', source_hashes=HASHES)
+
+    response = client.post('/api/auth/extract-and-save', json={'phone': '+1'})
+
+    assert response.status_code == 409
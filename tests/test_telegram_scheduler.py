@@ -0,0 +1,169 @@
+import json
+import sqlite3
+
+import pytest
+from telethon.errors import FloodWaitError
+
+import manager
+from manager import TelegramScheduler
+
+
+def flood_wait(seconds):
+    return FloodWaitError(request=None, capture=seconds)
+
+
+class StubClient:
+    """Имитирует вызов Telegram: сначала бросает заданные ошибки, потом возвращает результат."""
+
+    def __init__(self, clock, errors, result='ok'):
+        self.clock = clock
+        self.errors = list(errors)
+        self.result = result
+        self.calls = []
+
+    def __call__(self):
+        self.calls.append(self.clock.now)
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.result
+
+
+def make_scheduler(clock, **kwargs):
+    options = {'rate': 1.0, 'burst': 2, 'max_retries': 3, 'max_flood_wait': 300}
+    options.update(kwargs)
+    return TelegramScheduler(clock=clock, sleep=clock.sleep, **options)
+
+
+def test_token_bucket_refills_at_rate(clock):
+    scheduler = make_scheduler(clock, rate=0.5, burst=2)
+    client = StubClient(clock, [])
+
+    for _ in range(4):
+        scheduler.call(2, client)
+
+    assert client.calls == [0.0, 0.0, 2.0, 4.0]
+
+
+def test_buckets_are_per_dc(clock):
+    scheduler = make_scheduler(clock, burst=1)
+    client = StubClient(clock, [])
+
+    scheduler.call(1, client)
+    scheduler.call(2, client)
+
+    assert client.calls == [0.0, 0.0]
+
+
+def test_flood_wait_parks_dc_and_retries(clock):
+    scheduler = make_scheduler(clock)
+    client = StubClient(clock, [flood_wait(30)])
+    other = StubClient(clock, [])
+
+    assert scheduler.call(2, client) == 'ok'
+    assert client.calls == [0.0, 30.0]
+    assert scheduler.stats()['flood_waits'] == 1
+
+    scheduler.call(4, other)
+    assert other.calls == [30.0]
+
+
+def test_parked_dc_is_reported_in_stats(clock):
+    scheduler = make_scheduler(clock, max_retries=0)
+
+    with pytest.raises(FloodWaitError):
+        scheduler.call(2, StubClient(clock, [flood_wait(60)]))
+
+    assert scheduler.stats()['dcs']['2']['parked_for'] == 60.0
+
+
+def test_flood_wait_above_limit_is_not_waited(clock):
+    scheduler = make_scheduler(clock, max_flood_wait=100)
+    client = StubClient(clock, [flood_wait(3600)])
+
+    with pytest.raises(FloodWaitError):
+        scheduler.call(2, client)
+
+    assert client.calls == [0.0]
+    assert clock.now == 0.0
+
+    clock.now = 10.0
+    later = StubClient(clock, [])
+    with pytest.raises(FloodWaitError) as error:
+        scheduler.call(2, later)
+    assert error.value.seconds == 3590
+    assert later.calls == []
+
+    clock.now = 3550.0
+    scheduler.call(2, later)
+    assert later.calls == [3600.0]
+
+
+def test_flood_waits_share_one_budget_per_call(clock):
+    scheduler = make_scheduler(clock, max_flood_wait=20)
+    client = StubClient(clock, [flood_wait(15), flood_wait(15)])
+
+    with pytest.raises(FloodWaitError):
+        scheduler.call(2, client)
+
+    assert client.calls == [0.0, 15.0]
+    assert clock.now == 15.0
+
+
+def test_clients_leave_flood_waits_to_scheduler(clock, monkeypatch, sessions_dir):
+    created = []
+
+    class FakeClient:
+        def __init__(self, *args, **kwargs):
+            created.append(kwargs)
+
+        async def connect(self):
+            raise OSError('offline')
+
+        async def disconnect(self):
+            pass
+
+    monkeypatch.setattr(manager, 'TelegramClient', FakeClient)
+    monkeypatch.setattr(manager, 'telegram_scheduler', make_scheduler(clock, max_retries=0))
+
+    assert manager.is_session_valid(sessions_dir / '+1.session', 1, 'hash') is False
+    assert created == [{'flood_sleep_threshold': 0}]
+
+
+def test_os_error_is_retried_with_backoff(clock):
+    scheduler = make_scheduler(clock, burst=10, backoff=1.0)
+    client = StubClient(clock, [ConnectionError('reset'), OSError('down')])
+
+    assert scheduler.call(2, client) == 'ok'
+    assert clock.sleeps == [1.0, 2.0]
+    assert client.calls == [0.0, 1.0, 3.0]
+
+
+def test_os_error_gives_up_after_max_retries(clock):
+    scheduler = make_scheduler(clock, burst=10, max_retries=2)
+    client = StubClient(clock, [OSError('down')] * 3)
+
+    with pytest.raises(OSError):
+        scheduler.call(2, client)
+
+    assert len(client.calls) == 3
+
+
+def test_session_dc_id_prefers_json(sessions_dir):
+    (sessions_dir / '+1.json').write_text(json.dumps({'dc_id': 4}), encoding='utf-8')
+
+    assert manager.session_dc_id(sessions_dir / '+1.session') == 4
+
+
+def test_session_dc_id_reads_session_file_without_json(sessions_dir):
+    session_file = sessions_dir / '+1.session'
+    conn = sqlite3.connect(str(session_file))
+    conn.execute("CREATE TABLE sessions (dc_id INTEGER, server_address TEXT, port INTEGER, auth_key BLOB)")
+    conn.execute("INSERT INTO sessions VALUES (5, '91.108.56.130', 443, NULL)")
+    conn.commit()
+    conn.close()
+
+    assert manager.session_dc_id(session_file) == 5
+
+
+def test_session_dc_id_defaults_to_zero(sessions_dir):
+    assert manager.session_dc_id(sessions_dir / 'missing.session') == 0
@@ -0,0 +1,192 @@
+import json
+import time
+
+import pytest
+
+import manager
+from manager import WarmDevicePool
+
+
+def fake_warm(self, device):
+    with self._lock:
+        if self._states.get(device) == 'warming':
+            self._states[device] = 'warm'
+
+
+@pytest.fixture(autouse=True)
+def no_adb(monkeypatch):
+    monkeypatch.setattr(WarmDevicePool, '_warm', fake_warm)
+    monkeypatch.setattr(manager, 'telegram_in_foreground', lambda device=None: True)
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert predicate()
+
+
+def test_in_use_devices_are_never_taken():
+    pool = WarmDevicePool(['a', 'b'], 0)
+
+    assert pool.acquire('+1') == ('a', False)
+    assert pool.acquire('+2') == ('b', False)
+    assert pool.acquire('+3') == (None, False)
+    assert pool.device_for('+1') == 'a'
+
+
+def test_same_phone_releases_its_own_device():
+    pool = WarmDevicePool(['a'], 1)
+    pool.replenish()
+    wait_for(lambda: pool.stats()['warm'] == 1)
+
+    assert pool.acquire('+1') == ('a', True)
+    assert pool.acquire('+1') == ('a', False)
+    assert pool.stats()['devices'] == {'a': 'in_use'}
+
+
+def test_released_device_keeps_phone_until_reclaimed():
+    pool = WarmDevicePool(['a', 'b'], 0)
+    pool.acquire('+1')
+    pool.release('a')
+
+    assert pool.device_for('+1') == 'a'
+    assert pool.acquire('+2') == ('b', False)
+    assert pool.acquire('+3') == ('a', False)
+    assert pool.device_for('+1') is None
+
+
+def test_done_device_is_rewarmed_when_pool_needs_it():
+    pool = WarmDevicePool(['a'], 1)
+    pool.replenish()
+    wait_for(lambda: pool.stats()['warm'] == 1)
+
+    pool.acquire('+1')
+    pool.release('a')
+
+    wait_for(lambda: pool.stats()['devices'] == {'a': 'warm'})
+    assert pool.device_for('+1') is None
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(manager, 'ANDROID_SESSION_AVAILABLE', True)
+    monkeypatch.setattr(manager, 'login_drivers', {})
+    monkeypatch.setattr(manager, 'warm_pool', WarmDevicePool(['dev1'], 0))
+    monkeypatch.setattr(manager, 'probe_device_session', lambda device=None: (True, {'tgnet.dat': 'h'}))
+    monkeypatch.setattr(manager, 'device_account_phone', lambda device=None: None)
+    return manager.app.test_client()
+
+
+def save_cached_session(sessions_dir, phone):
+    (sessions_dir / f'{phone}.session').write_bytes(b'')
+    (sessions_dir / f'{phone}.json').write_text(
+        json.dumps({'account_phone': phone.lstrip('+'), 'source_hashes': {'tgnet.dat': 'h'}}), encoding='utf-8')
+
+
+def test_expired_lease_is_reclaimed():
+    pool = WarmDevicePool(['a'], 0, lease_ttl=0.05)
+    pool.acquire('+1')
+
+    assert pool.acquire('+2') == (None, False)
+    time.sleep(0.1)
+    assert pool.acquire('+2') == ('a', False)
+    assert pool.device_for('+1') is None
+
+
+def test_extract_without_leased_device_is_conflict(client):
+    response = client.post('/api/auth/extract-and-save', json={'phone': '+1'})
+
+    assert response.status_code == 409
+
+
+def test_not_authorized_extraction_releases_device(client, monkeypatch):
+    monkeypatch.setattr(manager, 'probe_device_session', lambda device=None: (False, None))
+    manager.warm_pool.acquire('+1')
+
+    response = client.post('/api/auth/extract-and-save', json={'phone': '+1'})
+
+    assert response.status_code == 400
+    assert manager.warm_pool.acquire('+2') == ('dev1', False)
+
+
+def test_extraction_during_login_is_conflict(client):
+    manager.warm_pool.acquire('+1')
+    driver = manager.LoginDriver('+1', device='dev1')
+    driver.state = 'waiting_for_code'
+    manager.login_drivers['+1'] = driver
+
+    response = client.post('/api/auth/extract-and-save', json={'phone': '+1'})
+
+    assert response.status_code == 409
+    assert manager.login_drivers['+1'] is driver
+    assert manager.warm_pool.stats()['devices'] == {'dev1': 'in_use'}
+
+
+def test_extract_finds_device_by_account_without_lease(client, sessions_dir, monkeypatch):
+    save_cached_session(sessions_dir, '+71')
+    monkeypatch.setattr(manager, 'device_account_phone', lambda device=None: '71')
+
+    response = client.post('/api/auth/extract-and-save', json={'phone': '+71'})
+
+    assert response.json['cached'] is True
+    assert manager.warm_pool.device_for('+71') == 'dev1'
+    assert manager.warm_pool.stats()['devices'] == {'dev1': 'done'}
+
+
+def test_extract_ignores_device_of_other_account(client, sessions_dir, monkeypatch):
+    save_cached_session(sessions_dir, '+71')
+    monkeypatch.setattr(manager, 'device_account_phone', lambda device=None: '72')
+
+    response = client.post('/api/auth/extract-and-save', json={'phone': '+71'})
+
+    assert response.status_code == 409
+    assert manager.warm_pool.stats()['devices'] == {'dev1': 'idle'}
+
+
+def test_failed_login_does_not_release_reclaimed_device(client):
+    manager.warm_pool.lease_ttl = 0
+    manager.warm_pool.acquire('+1')
+    driver = manager.LoginDriver('+1', device='dev1', on_error=manager.release_failed_login)
+    manager.login_drivers['+1'] = driver
+    time.sleep(0.01)
+    manager.warm_pool.acquire('+2')
+
+    driver._set_state('error', 'Вход отменён')
+
+    assert manager.warm_pool.device_for('+2') == 'dev1'
+    assert manager.warm_pool.stats()['devices'] == {'dev1': 'in_use'}
+
+
+def test_cached_extraction_releases_device(client, sessions_dir):
+    save_cached_session(sessions_dir, '+1')
+    manager.warm_pool.acquire('+1')
+
+    response = client.post('/api/auth/extract-and-save', json={'phone': '+1'})
+
+    assert response.json['cached'] is True
+    assert manager.warm_pool.stats()['devices'] == {'dev1': 'done'}
+    assert manager.warm_pool.device_for('+1') == 'dev1'
+
+
+def test_account_mismatch_is_conflict(client, monkeypatch):
+    def extract(phone, hashes, device):
+        manager.check_account_phone(phone, '79990000000')
+
+    monkeypatch.setattr(manager, 'extract_session_with_android_porter', extract)
+    manager.warm_pool.acquire('+71')
+
+    response = client.post('/api/auth/extract-and-save', json={'phone': '+71', 'force': True})
+
+    assert response.status_code == 409
+    assert manager.warm_pool.stats()['devices'] == {'dev1': 'done'}
+
+
+def test_check_account_phone_compares_digits():
+    manager.check_account_phone('+7 (900) 123-45-67', '79001234567')
+
+    with pytest.raises(manager.AccountMismatchError):
+        manager.check_account_phone('+79001234567', '79001234568')
+
+    with pytest.raises(manager.AccountMismatchError):
+        manager.check_account_phone('+79001234567', None)